@@ -13,52 +13,122 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import glob
+from concurrent import futures
+import contextlib
+import fnmatch
+import functools
+import io
 import itertools
 import logging
+import math
 import operator
 import os
+import posixpath
 import re
 import subprocess
 import sys
 import tempfile
+import threading
 from urllib import parse
 
 import attr
 import daiquiri
 import github
+import requests
 
+from git_pull_request import backend
 from git_pull_request import bitbucket
+from git_pull_request import daemon
+from git_pull_request import gitrepo
+from git_pull_request import journal
+from git_pull_request import lock
 from git_pull_request import pagure
+from git_pull_request import pulls as pull_index
+from git_pull_request import results
 from git_pull_request import textparse
+from git_pull_request import timeouts
+from git_pull_request import tokens
+from git_pull_request import watch as watcher
 
 
 LOG = daiquiri.getLogger("git-pull-request")
 
+# Maximum length of a pull request body on GitHub
+BODY_MAX_LENGTH = 65536
 
-@attr.s(eq=False, hash=False)
+# Kept for the whole process lifetime so the daemon can reuse them
+_CREDENTIALS = {}
+_CLIENTS = {}
+
+# Set by the daemon to have the editor run by its client
+editor_hook = None
+
+# Set by the daemon to send the output of the commands to its client, which
+# would otherwise be written on the terminal of the daemon, and with --json
+# to keep stdout for the results
+child_output = None
+
+# Cleared by the daemon, which cannot prompt its client for credentials
+credential_prompt = True
+
+
+@attr.s(eq=False, hash=False, frozen=True)
 class RepositoryId:
     hosttype = attr.ib(type=str)
     hostname = attr.ib(type=str)
     user = attr.ib(type=str)
     repository = attr.ib(type=str)
 
-    def __eq__(self, other):
-        return (
-            self.hosttype == other.hosttype
-            and self.hostname.lower() == other.hostname.lower()
-            and self.user.lower() == other.user.lower()
-            and self.repository.lower() == other.repository.lower()
+    def __attrs_post_init__(self):
+        # Forges compare hosts, users and repositories case-insensitively
+        object.__setattr__(
+            self,
+            "_key",
+            (
+                self.hosttype,
+                self.hostname.lower(),
+                self.user and self.user.lower(),
+                self.repository.lower(),
+            ),
         )
 
+    def __eq__(self, other):
+        if not isinstance(other, RepositoryId):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return hash(self._key)
 
-def _run_shell_command(cmd, output=None, raise_on_error=True):
-    if output is True:
+
+def _forward_child_output(output):
+    if output:
+        child_output(output.decode(errors="replace").rstrip("\n"))
+
+
+def _run_shell_command(cmd, output=None, raise_on_error=True, env=None):
+    forward = output is None and child_output is not None
+    if output is True or forward:
         output = subprocess.PIPE
 
+    phase = "running `%s'" % " ".join(cmd)
+    timeouts.check(phase)
     LOG.debug("running %s", cmd)
-    sub = subprocess.Popen(cmd, stdout=output, stderr=output)
-    out = sub.communicate()
+    sub = subprocess.Popen(
+        cmd,
+        stdout=output,
+        stderr=subprocess.STDOUT if forward else output,
+        env=env,
+    )
+    try:
+        out = sub.communicate(timeout=timeouts.remaining())
+    except subprocess.TimeoutExpired:
+        sub.kill()
+        sub.communicate()
+        raise timeouts.DeadlineExceeded(phase)
+    if forward:
+        _forward_child_output(out[0])
+        out = (None, None)
     if raise_on_error and sub.returncode:
         raise RuntimeError("%s returned %d" % (cmd, sub.returncode))
 
@@ -66,19 +136,92 @@ def _run_shell_command(cmd, output=None, raise_on_error=True):
         return out[0].strip().decode()
 
 
-def get_login_password(protocol="https", host="github.com"):
-    """Get login/password from git credential."""
+def _stream_shell_command(cmd, separator="\n", raise_on_error=True):
+    """Run a command and yield its output records as they are produced.
+
+    Only the record being read is kept in memory, whatever the size of the
+    output. When the caller stops iterating, the command is killed.
+
+    :param separator: The record separator, e.g. "\\0" for `git -z` output
+    """
+    LOG.debug("running %s", cmd)
+    # Errors are forwarded once the command is done
+    stderr = None if child_output is None else tempfile.TemporaryFile()
+    sub = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+    separator = separator.encode()
+    pending = bytearray()
+    completed = False
+    try:
+        for chunk in iter(sub.stdout.read1, b""):
+            pending += chunk
+            start = 0
+            while True:
+                end = pending.find(separator, start)
+                if end == -1:
+                    break
+                yield pending[start:end].decode()
+                start = end + len(separator)
+            del pending[:start]
+        if pending:
+            yield pending.decode()
+        completed = True
+    finally:
+        if not completed:
+            sub.kill()
+        sub.stdout.close()
+        sub.wait()
+        if stderr is not None:
+            stderr.seek(0)
+            _forward_child_output(stderr.read())
+            stderr.close()
+    if sub.returncode and raise_on_error:
+        raise RuntimeError("%s returned %d" % (cmd, sub.returncode))
+
+
+def _git_credential(action, request, path=None, prompt=True):
+    cmd = ["git"]
+    env = None
+    if path is not None:
+        # Helpers ignore the path unless told otherwise
+        cmd += ["-c", "credential.useHttpPath=true"]
+    if not prompt:
+        env = dict(os.environ, GIT_TERMINAL_PROMPT="0", GIT_ASKPASS="")
     subp = subprocess.Popen(
-        ["git", "credential", "fill"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+        cmd + ["credential", action],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=None if prompt else subprocess.DEVNULL,
+        env=env,
     )
-    # TODO add path support
-    request = "protocol={}\nhost={}\n".format(protocol, host).encode()
+    stdout, stderr = subp.communicate(input=request)
+    return subp.wait(), stdout
+
+
+def _credential_request(protocol, host, path=None, **fields):
+    request = "protocol={}\nhost={}\n".format(protocol, host)
+    if path is not None:
+        request += "path={}\n".format(path)
+    for key, value in fields.items():
+        request += "{}={}\n".format(key, value)
+    return request.encode()
+
+
+def get_login_password(protocol="https", host="github.com", path=None, prompt=True):
+    """Get login/password from git credential.
+
+    :param path: The path of the credential on the host
+    :param prompt: Whether the user may be asked for a missing credential
+    """
+    if (protocol, host, path) in _CREDENTIALS:
+        return _CREDENTIALS[(protocol, host, path)]
     username = None
     password = None
-    stdout, stderr = subp.communicate(input=request)
-    ret = subp.wait()
+    ret, stdout = _git_credential(
+        "fill", _credential_request(protocol, host, path), path, prompt
+    )
     if ret != 0:
-        LOG.error("git credential returned exited with status %d", ret)
+        if prompt:
+            LOG.error("git credential returned exited with status %d", ret)
         return None, None
     for line in stdout.split(b"\n"):
         key, _, value = line.partition(b"=")
@@ -88,52 +231,156 @@ def get_login_password(protocol="https", host="github.com"):
             password = value.decode()
         if username and password:
             break
+    if username and password:
+        _CREDENTIALS[(protocol, host, path)] = username, password
     return username, password
 
 
-def approve_login_password(user, password, host="github.com", protocol="https"):
+def approve_login_password(
+    user, password, host="github.com", protocol="https", path=None
+):
     """Tell git to approve the credential."""
-    subp = subprocess.Popen(
-        ["git", "credential", "approve"], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    request = _credential_request(
+        protocol, host, path, username=user, password=password
     )
-    request = "protocol={}\nhost={}\nusername={}\npassword={}\n".format(
-        protocol, host, user, password
-    ).encode()
-    subp.communicate(input=request)
-    ret = subp.wait()
+    ret, _ = _git_credential("approve", request, path)
     if ret != 0:
         LOG.error("git credential returned exited with status %d", ret)
 
 
+def _git_get_config_regexp(regexp):
+    """Yield the (key, value) configuration entries whose key matches."""
+    try:
+        config = gitrepo.Repository.discover().config
+    except gitrepo.Unsupported as e:
+        LOG.debug("Reading configuration with git: %s", e)
+    else:
+        regexp = re.compile(regexp)
+        for key, value in config:
+            if regexp.search(key):
+                yield key, value or ""
+        return
+
+    output = _stream_shell_command(
+        ["git", "config", "-z", "--get-regexp", regexp],
+        separator="\0",
+        raise_on_error=False,
+    )
+    for entry in filter(None, output):
+        key, _, value = entry.partition("\n")
+        yield key, value
+
+
+def _rewrite_url(url, rewrites):
+    """Rewrite `url` like git does with `url.<base>.insteadOf`.
+
+    :param rewrites: The (prefix, base) pairs, the longest prefix is used
+    """
+    matches = [(prefix, base) for prefix, base in rewrites if url.startswith(prefix)]
+    if not matches:
+        return url
+    prefix, base = max(matches, key=lambda match: len(match[0]))
+    return base + url[len(prefix) :]
+
+
+def _get_push_urls(urls, pushurls, rewrites, push_rewrites):
+    """Return the URLs git pushes to for a remote."""
+    if pushurls:
+        return [_rewrite_url(url, rewrites) for url in pushurls]
+    # Only URLs matching a pushInsteadOf are pushed to when there are some
+    aliased = [_rewrite_url(url, push_rewrites) for url in urls]
+    aliased = [alias for alias, url in zip(aliased, urls) if alias != url]
+    return aliased or [_rewrite_url(url, rewrites) for url in urls]
+
+
+def git_get_remote_index(hosttype=None):
+    """Return a mapping of repository identity to the remote pushing to it.
+
+    Remote URLs, their rewrites and the host type are read with a single git
+    call.
+
+    :param hosttype: The host type, read from the configuration if not provided
+    """
+    urls = {}
+    pushurls = {}
+    rewrites = []
+    push_rewrites = []
+    for key, value in _git_get_config_regexp(
+        r"^(remote\..*\.(url|pushurl)|url\..*\.(insteadof|pushinsteadof)"
+        r"|git-pull-request\.hosttype)$"
+    ):
+        if key == "git-pull-request.hosttype":
+            hosttype = hosttype or value
+        elif key.endswith(".pushinsteadof"):
+            push_rewrites.append((value, key[4:-14]))
+        elif key.endswith(".insteadof"):
+            rewrites.append((value, key[4:-10]))
+        elif key.endswith(".pushurl"):
+            pushurls.setdefault(key[7:-8], []).append(value)
+        else:
+            urls.setdefault(key[7:-4], []).append(value)
+
+    index = {}
+    for name in sorted(urls.keys() | pushurls.keys()):
+        for url in _get_push_urls(
+            urls.get(name, []), pushurls.get(name), rewrites, push_rewrites
+        ):
+            try:
+                remote_id = get_repository_id_from_url(url, hosttype)
+            except ValueError:
+                LOG.debug("Ignoring remote `%s' with URL `%s'", name, url)
+                continue
+            hosttype = remote_id.hosttype
+            index.setdefault(remote_id, name)
+    return index
+
+
 def git_remote_matching_url(wanted_url):
-    wanted_id = get_repository_id_from_url(wanted_url)
+    wanted = get_repository_id_from_url(wanted_url)
+    return git_get_remote_index(wanted.hosttype).get(wanted)
+
+
+def git_get_config_value(key):
+    """Return the value of `key` like `git config --get`, or None if unset.
+
+    The configuration is read without running git when possible.
+    """
+    try:
+        return gitrepo.Repository.discover().get_config(key)
+    except gitrepo.Unsupported as e:
+        LOG.debug("Reading `%s' with git: %s", key, e)
+    try:
+        return _run_shell_command(["git", "config", "--get", key], output=True)
+    except RuntimeError:
+        return None
 
-    remotes = _run_shell_command(["git", "remote", "-v"], output=True).split("\n")
-    for remote in remotes:
-        name, remote_url, push_pull = re.split(r"\s", remote)
-        if push_pull != "(push)":
-            continue
-        remote_id = get_repository_id_from_url(remote_url)
 
-        if wanted_id == remote_id:
-            return name
+def git_get_config_all(key):
+    """Return all the values of `key` like `git config --get-all`."""
+    try:
+        values = gitrepo.Repository.discover().get_config_all(key)
+    except gitrepo.Unsupported as e:
+        LOG.debug("Reading `%s' with git: %s", key, e)
+        output = _run_shell_command(
+            ["git", "config", "-z", "--get-all", key],
+            output=True,
+            raise_on_error=False,
+        )
+        values = output.split("\0") if output else []
+    # Variables without value are shown as empty
+    return [value or "" for value in values]
 
 
 def git_remote_url(remote="origin", raise_on_error=True):
-    return _run_shell_command(
-        ["git", "config", "--get", "remote." + remote + ".url"],
-        output=True,
-        raise_on_error=raise_on_error,
-    )
+    url = git_get_config_value("remote." + remote + ".url")
+    if url is None and raise_on_error:
+        raise RuntimeError("Remote `%s' has no URL" % remote)
+    return url or ""
 
 
 def git_get_config(option, default):
-    try:
-        return _run_shell_command(
-            ["git", "config", "--get", "git-pull-request." + option], output=True
-        )
-    except RuntimeError:
-        return default
+    value = git_get_config_value("git-pull-request." + option)
+    return default if value is None else value
 
 
 def git_config_add_argument(parser, option, *args, **kwargs):
@@ -154,43 +401,36 @@ def git_config_add_argument(parser, option, *args, **kwargs):
 
 
 def git_get_branch_name():
-    branch = _run_shell_command(
-        ["git", "rev-parse", "--abbrev-ref", "HEAD"], output=True
-    )
+    try:
+        branch = gitrepo.Repository.discover().get_head_branch()
+    except gitrepo.Unsupported as e:
+        LOG.debug("Reading HEAD with git: %s", e)
+        branch = _run_shell_command(
+            ["git", "rev-parse", "--abbrev-ref", "HEAD"], output=True
+        )
     if branch == "HEAD":
         raise RuntimeError("Unable to determine current branch")
     return branch
 
 
 def git_get_remote_for_branch(branch):
-    return _run_shell_command(
-        ["git", "config", "--get", "branch." + branch + ".remote"],
-        output=True,
-        raise_on_error=False,
-    )
+    return git_get_config_value("branch." + branch + ".remote") or ""
 
 
 def git_get_remote_branch_for_branch(branch):
-    branch = _run_shell_command(
-        ["git", "config", "--get", "branch." + branch + ".merge"],
-        output=True,
-        raise_on_error=False,
-    )
+    branch = git_get_config_value("branch." + branch + ".merge") or ""
     if branch.startswith("refs/heads/"):
         return branch[11:]
     return branch
 
 
 def git_get_config_hosttype():
-    return _run_shell_command(
-        ["git", "config", "git-pull-request.hosttype"],
-        output=True,
-        raise_on_error=False,
-    )
+    return git_get_config_value("git-pull-request.hosttype") or ""
 
 
 def git_set_config_hosttype(hosttype):
-    _run_shell_command(["git", "config", "git-pull-request.hosttype", hosttype])
+    with lock.locked(git_get_common_dir(), "config"):
+        _run_shell_command(["git", "config", "git-pull-request.hosttype", hosttype])
 
 
 def get_hosttype(host):
@@ -206,12 +446,8 @@ def get_hosttype(host):
     return hosttype
 
 
-def get_repository_id_from_url(url):
-    """Return hostype, hostname, user and repository to fork from.
-
-    :param url: The URL to parse
-    :return: hosttype, hostname, user, repository
-    """
+@functools.lru_cache(maxsize=None)
+def _parse_repository_url(url):
     parsed = parse.urlparse(url)
     if parsed.netloc == "":
         # Probably ssh
@@ -223,7 +459,19 @@ def get_repository_id_from_url(url):
         host = parsed.netloc
         if "@" in host:
             username, sep, host = host.partition("@")
-    hosttype = get_hosttype(host)
+    return host, path
+
+
+def get_repository_id_from_url(url, hosttype=None):
+    """Return hostype, hostname, user and repository to fork from.
+
+    :param url: The URL to parse
+    :param hosttype: The host type, detected if not provided
+    :return: hosttype, hostname, user, repository
+    """
+    host, path = _parse_repository_url(url)
+    if hosttype is None:
+        hosttype = get_hosttype(host)
     if hosttype == "pagure":
         user, repo = None, path
     else:
@@ -235,10 +483,6 @@ def get_repository_id_from_url(url):
     return RepositoryId(hosttype, host, user, repo)
 
 
-def split_and_remove_empty_lines(s):
-    return filter(operator.truth, s.split("\n"))
-
-
 def parse_pr_message(message):
     message = textparse.remove_ignore_marker(message)
     message_by_line = message.split("\n")
@@ -256,51 +500,90 @@ def git_get_commit_body(commit):
 
 
 def git_get_log_titles(begin, end):
-    log = _run_shell_command(
-        ["git", "log", "--no-merges", "--format=%s", "%s..%s" % (begin, end)],
-        output=True,
+    return filter(
+        None,
+        _stream_shell_command(
+            ["git", "log", "--no-merges", "--format=%s", "%s..%s" % (begin, end)]
+        ),
     )
-    return list(split_and_remove_empty_lines(log))
 
 
-def git_get_log(begin, end):
-    return _run_shell_command(
+def git_count_commits(begin, end):
+    return int(
+        _run_shell_command(
+            ["git", "rev-list", "--count", "--no-merges", "%s..%s" % (begin, end)],
+            output=True,
+        )
+    )
+
+
+def _more_commits(count):
+    return "... and %d more commit%s" % (count, "s" if count > 1 else "")
+
+
+def git_get_log(begin, end, max_length=None):
+    """Return the log of the commits between 2 commits.
+
+    :param max_length: If set, commits are left out of the log once it
+                       reaches this length and replaced by their count
+    """
+    entries = []
+    length = 0
+    log = _stream_shell_command(
         [
             "git",
             "log",
+            "-z",
             "--no-merges",
             "--reverse",
             "--format=## %s%n%n%b",
             "%s..%s" % (begin, end),
         ],
-        output=True,
+        separator="\0",
     )
+    for entry in log:
+        if max_length is not None and length + len(entry) + 1 > max_length:
+            log.close()
+            more = git_count_commits(begin, end) - len(entries)
+            # Make room for the summary
+            while entries and length + len(_more_commits(more)) > max_length:
+                length -= len(entries.pop()) + 1
+                more += 1
+            entries.append(_more_commits(more))
+            break
+        entries.append(entry)
+        length += len(entry) + 1
+    return "\n".join(entries).strip()
 
 
-def git_get_title_and_message(begin, end):
+def git_get_title_and_message(begin, end, max_length=None):
     """Get title and message summary for patches between 2 commits.
 
     :param begin: first commit to look at
     :param end: last commit to look at
+    :param max_length: maximum length of the message
     :return: number of commits, title, message
     """
     titles = git_get_log_titles(begin, end)
-    if len(titles) == 1:
-        title = titles[0]
-    else:
+    title = next(titles, None)
+    # Count the other commits without keeping their title
+    nb_commits = sum(1 for _ in titles) + (title is not None)
+    if nb_commits != 1:
         title = "Pull request for " + end
 
     pr_template = get_pull_request_template()
     if pr_template is not None:
-        message = textparse.concat_with_ignore_marker(
-            pr_template, git_get_log(begin, end)
-        )
-    elif len(titles) == 1:
+        header = textparse.concat_with_ignore_marker(pr_template, "")
+        log_max_length = None
+        if max_length is not None:
+            log_max_length = max(0, max_length - len(header))
+        message = header + git_get_log(begin, end, log_max_length)
+    elif nb_commits == 1:
         message = git_get_commit_body(end)
     else:
-        message = git_get_log(begin, end)
+        message = git_get_log(begin, end, max_length)
 
-    return len(titles), title, message
+    return nb_commits, title, message
 
 
 def git_pull_request(
@@ -318,22 +601,45 @@ def git_pull_request(
     branch_prefix=None,
     dry_run=False,
     labels=None,
+    worktree_dir=None,
+    stack=False,
+    max_body_size=BODY_MAX_LENGTH,
+    offline=False,
+    branch=None,
+    edit_message=True,
+    watch=False,
+    list_pulls=False,
+    mirror_remotes=None,
+    rebase_in_memory=False,
+    worktree=False,
+    sparse=False,
+    queue_on_error=False,
 ):
-    branch = git_get_branch_name()
+    branch = branch or git_get_branch_name()
     if not branch:
         LOG.critical("Unable to find current branch")
         return 10
 
     LOG.debug("Local branch name is `%s'", branch)
 
-    target_branch = target_branch or git_get_remote_branch_for_branch(branch)
+    if stack:
+        stack = git_get_stack(branch)[:-1]
+        if stack:
+            LOG.info("Sending stack of branches %s", ", ".join(stack + [branch]))
+            # Stacked pull requests target branches of the target repository
+            fork = "never"
+        bottom = (stack or [branch])[0]
+    else:
+        bottom = branch
+
+    target_branch = target_branch or git_get_remote_branch_for_branch(bottom)
 
     if not target_branch:
         target_branch = "master"
         LOG.info(
             "No target branch configured for local branch `%s', using `%s'.\n"
             "Use the --target-branch option to override.",
-            branch,
+            bottom,
             target_branch,
         )
 
@@ -353,6 +659,43 @@ def git_pull_request(
 
     LOG.debug("Remote URL for remote `%s' is `%s'", target_remote, target_url)
 
+    if list_pulls and offline:
+        return list_pull_requests(target_url)
+
+    entry = dict(
+        target_remote=target_remote,
+        target_branch=target_branch,
+        branch=branch,
+        title=title,
+        message=message,
+        keep_message=keep_message,
+        comment=comment,
+        labels=labels,
+        fork=fork,
+        branch_prefix=branch_prefix,
+        stack=bool(stack),
+        max_body_size=max_body_size,
+        mirror_remotes=mirror_remotes,
+    )
+
+    if offline:
+        if edit_message and not keep_message and (not title or not message):
+            if stack:
+                git_base = stack[-1]
+            else:
+                git_base = "%s/%s" % (target_remote, target_branch)
+            _, git_title, git_message = git_get_title_and_message(
+                git_base, branch, max_body_size
+            )
+            title, message = edit_title_and_message(
+                title or git_title, message or git_message
+            )
+            if title is None:
+                LOG.critical("Pull-request message is empty, aborting")
+                return 40
+            entry.update(title=title, message=message)
+        return queue_pull_request(entry)
+
     hosttype, hostname, user_to_fork, reponame_to_fork = attr.astuple(
         get_repository_id_from_url(target_url)
     )
@@ -364,95 +707,563 @@ def git_pull_request(
         hostname,
     )
 
-    user, password = get_login_password(host=hostname)
+    user, password = get_login_password(host=hostname, prompt=credential_prompt)
     if not user and not password:
         LOG.critical(
             "Unable to find your credentials for %s.\n"
             "Make sure you have a git credential working.",
             hostname,
         )
+        if not credential_prompt:
+            LOG.critical(
+                "The daemon cannot prompt for them: store them with a git "
+                "credential helper, or stop the daemon."
+            )
         return 35
 
     LOG.debug("Found %s user: `%s' password: <redacted>", hostname, user)
 
+    try:
+        g, repo = get_client(
+            hosttype, hostname, user, password, user_to_fork, reponame_to_fork
+        )
+    except requests.exceptions.ConnectionError:
+        if download is not None or setup_only or timeouts.expired():
+            raise
+        if not list_pulls and not queue_on_error:
+            raise
+        LOG.error("Unable to connect to %s", hostname, exc_info=True)
+        if list_pulls:
+            return list_pull_requests(target_url)
+        queue_pull_request(entry)
+        return 45
+
+    if list_pulls:
+        retcode = list_pull_requests(target_url, repo)
+        approve_login_password(host=hostname, user=user, password=password)
+        return retcode
+
+    if download is not None and (
+        len(download) > 1 or ((worktree or sparse) and not download_setup)
+    ):
+        retcode = download_pull_requests(
+            g, repo, target_remote, download, worktree_dir, sparse
+        )
+    elif download is not None:
+        retcode = download_pull_request(
+            g,
+            repo,
+            target_remote,
+            download[0],
+            download_setup,
+            worktree or sparse,
+            worktree_dir,
+            sparse,
+        )
+
+    else:
+        push_args = dict(
+            g=g,
+            hosttype=hosttype,
+            repo_to_fork=repo,
+            rebase=rebase,
+            target_remote=target_remote,
+            target_branch=target_branch,
+            branch=branch,
+            user=user,
+            title=title,
+            message=message,
+            keep_message=keep_message,
+            comment=comment,
+            fork=fork,
+            setup_only=setup_only,
+            branch_prefix=branch_prefix,
+            dry_run=dry_run,
+            labels=labels,
+            stack=stack or None,
+            max_body_size=max_body_size,
+            edit_message=edit_message,
+            mirror_remotes=mirror_remotes,
+            rebase_in_memory=rebase_in_memory,
+        )
+        edited = {}
+        try:
+            retcode = fork_and_push_pull_request(edited=edited, **push_args)
+        except requests.exceptions.ConnectionError:
+            if not queue_on_error or setup_only or timeouts.expired():
+                raise
+            LOG.error("Unable to connect to %s", hostname, exc_info=True)
+            if branch in edited:
+                # Do not make the user write the message again
+                entry.update(zip(("title", "message"), edited[branch]))
+                entry["keep_message"] = False
+            queue_pull_request(entry)
+            return 45
+
+        if watch and not retcode and not setup_only:
+            approve_login_password(host=hostname, user=user, password=password)
+            return watch_pull_request(push_args)
+
+    approve_login_password(host=hostname, user=user, password=password)
+
+    return retcode
+
+
+def list_pull_requests(target_url, repo=None):
+    """Show the open pull requests of the target repository.
+
+    :param repo: The repository to sync the index with first, or None to
+                 only show the index content
+    """
+    key = "%s:%s/%s/%s" % attr.astuple(get_repository_id_from_url(target_url))
+    git_dir = git_get_common_dir()
+    index = pull_index.load(git_dir, key)
+    if repo is None:
+        if index["synced"] is None:
+            LOG.warning("The pull request index has never been synced")
+    elif isinstance(repo, github.Repository.Repository):
+        count = pull_index.sync(repo, index)
+        LOG.debug("Synced %d pull requests", count)
+        pull_index.save(git_dir, key, index)
+    else:
+        LOG.warning("Syncing pull requests is only supported on GitHub")
+
+    for pull in pull_index.get_open(index):
+        LOG.info(
+            "#%d %s (%s:%s -> %s)",
+            pull["number"],
+            pull["title"],
+            pull["user"],
+            pull["head"],
+            pull["base"],
+        )
+    return 0
+
+
+def git_is_ancestor(commit, descendant):
+    try:
+        _run_shell_command(["git", "merge-base", "--is-ancestor", commit, descendant])
+    except RuntimeError:
+        return False
+    return True
+
+
+def watch_pull_request(push_args, interval=0.5, debounce=1.0):
+    """Push the branch and refresh its pull request each time it changes.
+
+    When commits were only appended to the branch, it is pushed as is and
+    the pull request title and message are kept, so neither rebase nor
+    editor get in the way.
+
+    :param push_args: The arguments of `fork_and_push_pull_request`
+    """
+    branch = push_args["branch"]
+    ref = "refs/heads/" + branch
+    tip = _run_shell_command(["git", "rev-parse", ref], output=True)
+    paths = watcher.get_ref_paths(git_get_common_dir(), ref)
+    LOG.info("Watching branch `%s' for new commits, press Ctrl-C to stop", branch)
+    try:
+        for _ in watcher.changes(paths, interval, debounce):
+            new_tip = _run_shell_command(
+                ["git", "rev-parse", "--verify", "-q", ref],
+                output=True,
+                raise_on_error=False,
+            )
+            if not new_tip or new_tip == tip:
+                continue
+            # The pull request may have changed on the forge meanwhile
+            backend.forget_responses()
+            # The comment and labels have been sent with the first push
+            kwargs = dict(push_args, comment=None, labels=None)
+            if git_is_ancestor(tip, new_tip):
+                LOG.info("New commits on branch `%s'", branch)
+                kwargs.update(rebase=False, keep_message=True, edit_message=False)
+            else:
+                LOG.info("Branch `%s' has been rewritten", branch)
+            try:
+                retcode = fork_and_push_pull_request(**kwargs)
+            except requests.exceptions.ConnectionError:
+                LOG.error("Unable to connect, will retry on the next change")
+                continue
+            except RuntimeError:
+                LOG.error("Unable to push branch `%s'", branch, exc_info=True)
+                continue
+            if retcode:
+                LOG.error("Unable to update the pull request (%d)", retcode)
+            # Rebasing moves the branch: use the pushed commit as reference
+            tip = _run_shell_command(["git", "rev-parse", ref], output=True)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def git_get_common_dir():
+    try:
+        return gitrepo.Repository.discover().common_dir
+    except gitrepo.Unsupported as e:
+        LOG.debug("Finding the git directory with git: %s", e)
+    return os.path.abspath(
+        _run_shell_command(["git", "rev-parse", "--git-common-dir"], output=True)
+    )
+
+
+def queue_pull_request(entry):
+    """Record a pull request to send with `flush_pull_requests`."""
+    journal.record(git_get_common_dir(), **entry)
+    LOG.warning(
+        "Pull request for branch `%s' has been queued.\n"
+        "Run `git pull-request --flush' to send it.",
+        entry["branch"],
+    )
+
+
+def flush_pull_requests(dry_run=False):
+    """Send the queued pull requests.
+
+    Operations queued for the same pull request are sent at once.
+    """
+    git_dir = git_get_common_dir()
+    with lock.locked(git_dir, "flush"):
+        return _flush_pull_requests(git_dir, dry_run)
+
+
+def _flush_pull_requests(git_dir, dry_run):
+    sent = []
+    retcode = None
+    for entries, entry in journal.collapse(journal.load(git_dir)):
+        LOG.info("Sending queued pull request for branch `%s'", entry["branch"])
+        try:
+            ret = git_pull_request(
+                target_remote=entry["target_remote"],
+                target_branch=entry["target_branch"],
+                title=entry["title"],
+                message=entry["message"],
+                keep_message=entry["keep_message"],
+                comment=entry["comment"],
+                rebase=False,
+                fork=entry["fork"],
+                branch_prefix=entry["branch_prefix"],
+                dry_run=dry_run,
+                labels=entry["labels"],
+                stack=entry["stack"],
+                max_body_size=entry["max_body_size"],
+                branch=entry["branch"],
+                edit_message=False,
+                mirror_remotes=entry.get("mirror_remotes"),
+            )
+        except requests.exceptions.ConnectionError:
+            LOG.error("Unable to connect, the pull request stays queued")
+            ret = 45
+        if ret:
+            retcode = retcode or ret
+        elif not dry_run:
+            sent.extend(entries)
+    # Keep what has been queued meanwhile or could not be sent
+    journal.remove(git_dir, sent)
+    return retcode
+
+
+def git_add_remote(name, url):
+    """Add a remote for `url`, or return the one another process added."""
+    # Detecting the host type takes the lock to store it
+    wanted = get_repository_id_from_url(url)
+    with lock.locked(git_get_common_dir(), "config"):
+        remote = git_get_remote_index(wanted.hosttype).get(wanted)
+        if remote:
+            LOG.debug("Found remote `%s' added meanwhile", remote)
+            return remote
+        _run_shell_command(["git", "remote", "add", name, url])
+    LOG.info("Added forked repository as remote `%s'", name)
+    return name
+
+
+def git_get_partial_clone_filter(remote):
+    """Return the object filter of a partial clone remote, or None."""
+    return (
+        _run_shell_command(
+            ["git", "config", "--get", "remote." + remote + ".partialclonefilter"],
+            output=True,
+            raise_on_error=False,
+        )
+        or None
+    )
+
+
+def git_network_command(*args):
+    """Return a git command giving up on HTTP transfers stalled too long."""
+    return [
+        "git",
+        "-c",
+        "http.lowSpeedLimit=1",
+        "-c",
+        "http.lowSpeedTime=%d" % timeouts.read_timeout,
+    ] + list(args)
+
+
+def git_fetch(remote, refspecs, object_filter=None):
+    cmd = git_network_command("fetch", "--no-tags")
+    if object_filter:
+        cmd.append("--filter=" + object_filter)
+    _run_shell_command(cmd + [remote] + list(refspecs))
+
+
+def get_client(hosttype, hostname, user, password, user_to_fork, reponame_to_fork):
+    """Return the forge client and the repository to fork.
+
+    Clients are cached so that their connection pools can be reused.
+    """
+    key = (hosttype, hostname, user, password, user_to_fork, reponame_to_fork)
+    cache = _CLIENTS
+    if hosttype not in ("bitbucket", "pagure"):
+        # PyGithub uses the same timeouts for all the requests of a client
+        key += (timeouts.connect_timeout, timeouts.read_timeout)
+        if timeouts.remaining() is not None:
+            # The timeouts are bounded by the deadline of this run only
+            cache = {}
+    if key in cache:
+        return cache[key]
+
     if hosttype == "bitbucket":
         g = bitbucket.Client(hostname, user, password, user_to_fork, reponame_to_fork)
         repo = g.get_repo(reponame_to_fork)
     elif hosttype == "pagure":
-        g = pagure.Client(hostname, user, password, reponame_to_fork)
+        g = pagure.Client(
+            hostname,
+            user,
+            password,
+            reponame_to_fork,
+            tokens.Store(git_get_common_dir(), hostname, user),
+        )
         repo = g.get_repo(reponame_to_fork)
     else:
         kwargs = {}
         if hostname != "github.com":
             kwargs["base_url"] = "https://" + hostname + "/api/v3"
             LOG.debug("Using API base url `%s'", kwargs["base_url"])
-        g = github.Github(user, password, **kwargs)
+        # PyGithub only takes a single timeout, in whole seconds
+        timeout = min(timeouts.get("connecting to " + hostname))
+        g = github.Github(user, password, timeout=math.ceil(timeout), **kwargs)
         repo = g.get_user(user_to_fork).get_repo(reponame_to_fork)
+    cache[key] = g, repo
+    return g, repo
 
-    if download is not None:
-        retcode = download_pull_request(
-            g, repo, target_remote, download, download_setup
-        )
-
-    else:
-        retcode = fork_and_push_pull_request(
-            g,
-            hosttype,
-            repo,
-            rebase,
-            target_remote,
-            target_branch,
-            branch,
-            user,
-            title,
-            message,
-            keep_message,
-            comment,
-            fork,
-            setup_only,
-            branch_prefix,
-            dry_run,
-            labels,
-        )
-
-    approve_login_password(host=hostname, user=user, password=password)
-
-    return retcode
 
+def download_pull_request(
+    g,
+    repo,
+    target_remote,
+    pull_number,
+    setup_remote,
+    worktree=False,
+    worktree_dir=None,
+    sparse=False,
+):
+    """Check out a pull request.
 
-def download_pull_request(g, repo, target_remote, pull_number, setup_remote):
+    :param worktree: Check it out in its own worktree rather than in the
+                     current one
+    :param sparse: Only check out the directories changed by the pull
+                   request in its worktree
+    """
     pull = repo.get_pull(pull_number)
+    object_filter = git_get_partial_clone_filter(target_remote)
+
     if setup_remote:
         local_branch_name = pull.head.ref
+        remote_name = "github-%s" % pull.user.login
+        with lock.locked(git_get_common_dir(), "config"):
+            remote = git_remote_url(remote_name, raise_on_error=False)
+            if not remote:
+                _run_shell_command(
+                    ["git", "remote", "add", remote_name, pull.head.repo.clone_url]
+                )
+                if object_filter:
+                    # Lazily fetch missing objects from the contributor fork too
+                    _run_shell_command(
+                        [
+                            "git",
+                            "config",
+                            "remote." + remote_name + ".promisor",
+                            "true",
+                        ]
+                    )
+                    _run_shell_command(
+                        [
+                            "git",
+                            "config",
+                            "remote." + remote_name + ".partialclonefilter",
+                            object_filter,
+                        ]
+                    )
+        # Only fetch the pull request branch, not every branch of the fork
+        remote_ref = "refs/remotes/%s/%s" % (remote_name, pull.head.ref)
+        git_fetch(
+            remote_name,
+            ["+refs/heads/%s:%s" % (pull.head.ref, remote_ref)],
+            object_filter,
+        )
+        start_point = remote_ref
     else:
         local_branch_name = "pull/%d-%s-%s" % (
             pull.number,
             pull.user.login,
             pull.head.ref,
         )
-    target_ref = "pull/%d/head" % pull.number
-
-    _run_shell_command(["git", "fetch", target_remote, target_ref])
-    try:
-        _run_shell_command(["git", "checkout", local_branch_name], output=True)
-    except RuntimeError:
-        _run_shell_command(["git", "checkout", "-b", local_branch_name, "FETCH_HEAD"])
+        git_fetch(target_remote, ["pull/%d/head" % pull.number], object_filter)
+        start_point = "FETCH_HEAD"
+
+    if worktree:
+        path = git_get_worktree_path(worktree_dir, pull.number)
+        exists = os.path.exists(path)
+        if not exists:
+            git_add_worktree(path, local_branch_name, start_point)
+        if sparse:
+            base_ref = "refs/remotes/%s/%s" % (target_remote, pull.base.ref)
+            git_fetch(
+                target_remote,
+                ["+refs/heads/%s:%s" % (pull.base.ref, base_ref)],
+                object_filter,
+            )
+            git_sparse_checkout(
+                path, git_get_changed_directories(base_ref, start_point)
+            )
+        if exists:
+            git_checkout_worktree(path, local_branch_name, start_point)
+        else:
+            _run_shell_command(["git", "-C", path, "reset", "-q", "--hard"])
+        LOG.info("Pull request #%d checked out in `%s'", pull.number, path)
     else:
-        _run_shell_command(["git", "reset", "--hard", "FETCH_HEAD"])
+        # Create or reset the branch and update the worktree in a single step
+        _run_shell_command(["git", "checkout", "-B", local_branch_name, start_point])
 
     if setup_remote:
-        remote_name = "github-%s" % pull.user.login
-        remote = git_remote_url(remote_name, raise_on_error=False)
-        if not remote:
-            _run_shell_command(
-                ["git", "remote", "add", remote_name, pull.head.repo.clone_url]
-            )
-        _run_shell_command(["git", "fetch", remote_name])
         _run_shell_command(
             ["git", "branch", "-u", "origin/%s" % pull.base.ref, local_branch_name]
         )
 
 
+def git_get_toplevel():
+    return _run_shell_command(["git", "rev-parse", "--show-toplevel"], output=True)
+
+
+def git_get_worktree_path(worktree_dir, pull_number):
+    if worktree_dir is None:
+        worktree_dir = git_get_toplevel() + "-pulls"
+    return os.path.join(worktree_dir, str(pull_number))
+
+
+def git_add_worktree(path, branch, start_point):
+    """Register a worktree for `branch` at `path` without populating it."""
+    _run_shell_command(
+        [
+            "git",
+            "worktree",
+            "add",
+            "-q",
+            "--no-checkout",
+            "--no-track",
+            "-B",
+            branch,
+            path,
+            start_point,
+        ]
+    )
+
+
+def git_checkout_worktree(path, branch, start_point):
+    """Check out `start_point` as `branch` in the worktree at `path`."""
+    _run_shell_command(
+        ["git", "-C", path, "checkout", "-q", "--no-track", "-B", branch, start_point]
+    )
+
+
+def git_get_changed_directories(base, head):
+    """Return the directories of the files changed by `head` since `base`."""
+    directories = set()
+    for path in _stream_shell_command(
+        ["git", "diff", "-z", "--name-only", "--no-renames", "%s...%s" % (base, head)],
+        separator="\0",
+    ):
+        directory = posixpath.dirname(path)
+        if directory:
+            directories.add(directory)
+    return sorted(directories)
+
+
+def git_sparse_checkout(path, directories):
+    """Only check out `directories` and the top-level files in `path`."""
+    _run_shell_command(
+        ["git", "-C", path, "sparse-checkout", "set", "--cone", "--"] + directories
+    )
+
+
+def download_pull_requests(
+    g, repo, target_remote, pull_numbers, worktree_dir=None, sparse=False
+):
+    """Download pull requests, each one in its own worktree.
+
+    The worktree of a pull request is reused by later downloads, only
+    updating the files that changed.
+
+    :param sparse: Only check out the directories changed by each pull request
+    """
+    with futures.ThreadPoolExecutor() as executor:
+        pulls = list(executor.map(repo.get_pull, pull_numbers))
+
+    # Fetch every pull request in one transfer
+    refs = {
+        pull.number: "refs/remotes/%s/pull/%d/head" % (target_remote, pull.number)
+        for pull in pulls
+    }
+    refspecs = ["+pull/%d/head:%s" % (number, ref) for number, ref in refs.items()]
+    if sparse:
+        # The base branches tell which files the pull requests change
+        refspecs += [
+            "+refs/heads/%s:refs/remotes/%s/%s" % (base, target_remote, base)
+            for base in sorted({pull.base.ref for pull in pulls})
+        ]
+    git_fetch(target_remote, refspecs, git_get_partial_clone_filter(target_remote))
+
+    jobs = {}
+    with futures.ThreadPoolExecutor() as executor:
+        for pull in pulls:
+            path = git_get_worktree_path(worktree_dir, pull.number)
+            branch = "pull/%d-%s-%s" % (pull.number, pull.user.login, pull.head.ref)
+            ref = refs[pull.number]
+            exists = os.path.exists(path)
+            if not exists:
+                # git does not support registering worktrees concurrently,
+                # only populate them in parallel
+                git_add_worktree(path, branch, ref)
+            if sparse:
+                # Serialized too, as it may update the repository configuration
+                git_sparse_checkout(
+                    path,
+                    git_get_changed_directories(
+                        "refs/remotes/%s/%s" % (target_remote, pull.base.ref), ref
+                    ),
+                )
+            if exists:
+                job = executor.submit(git_checkout_worktree, path, branch, ref)
+            else:
+                job = executor.submit(
+                    _run_shell_command, ["git", "-C", path, "reset", "-q", "--hard"]
+                )
+            jobs[job] = (pull, path)
+
+    failed = False
+    for job, (pull, path) in jobs.items():
+        try:
+            job.result()
+        except RuntimeError:
+            LOG.error("Unable to check out pull request #%d in `%s'", pull.number, path)
+            failed = True
+        else:
+            LOG.info("Pull request #%d checked out in `%s'", pull.number, path)
+    if failed:
+        raise RuntimeError("Unable to check out all pull requests")
+
+
 def edit_file_get_content_and_remove(filename):
     editor = _run_shell_command(["git", "var", "GIT_EDITOR"], output=True)
     if not editor:
@@ -470,29 +1281,64 @@ def edit_file_get_content_and_remove(filename):
     return content
 
 
+PULL_REQUEST_TEMPLATE_PATHS = (
+    "PULL_REQUEST_TEMPLATE*",
+    ".github/PULL_REQUEST_TEMPLATE/*.md",
+    ".github/PULL_REQUEST_TEMPLATE/*.txt",
+    ".github/PULL_REQUEST_TEMPLATE*",
+    "docs/PULL_REQUEST_TEMPLATE*",
+)
+
+
+def _match_template_path(path, pattern, case_sensitive):
+    path = path.split("/")
+    pattern = pattern.split("/")
+    if len(path) != len(pattern):
+        return False
+    if case_sensitive:
+        return all(map(fnmatch.fnmatchcase, path, pattern))
+    return all(
+        fnmatch.fnmatchcase(part.lower(), pat.lower())
+        for part, pat in zip(path, pattern)
+    )
+
+
 def get_pull_request_template():
-    filename = "PULL_REQUEST_TEMPLATE*"
-    pr_template_paths = [
-        filename,
-        ".github/PULL_REQUEST_TEMPLATE/*.md",
-        ".github/PULL_REQUEST_TEMPLATE/*.txt",
-        os.path.join(".github", filename),
-        os.path.join("docs", filename),
-        filename.lower(),
-        ".github/pull_request_template/*.md",
-        ".github/pull_request_template/*.txt",
-        os.path.join(".github", filename.lower()),
-        os.path.join("docs", filename.lower()),
-    ]
-    for path in pr_template_paths:
-        templates = glob.glob(path)
-        for template_path in templates:
-            if os.path.isfile(template_path):
-                with open(template_path) as t:
-                    return t.read()
+    """Return the content of the pull request template of the repository.
+
+    All candidate templates are looked up at once in the index, relative to
+    the top of the repository.
+    """
+    output = _stream_shell_command(
+        ["git", "ls-files", "-z", "--full-name", "--cached", "--"]
+        + [":(top,icase,glob)" + path for path in PULL_REQUEST_TEMPLATE_PATHS],
+        separator="\0",
+    )
+    candidates = []
+    for path in filter(None, output):
+        # Exact case matches of any pattern come first, then the others
+        for case_sensitive in (True, False):
+            priorities = [
+                priority
+                for priority, pattern in enumerate(PULL_REQUEST_TEMPLATE_PATHS)
+                if _match_template_path(path, pattern, case_sensitive)
+            ]
+            if priorities:
+                candidates.append((not case_sensitive, priorities[0], path))
+                break
+    if not candidates:
+        return None
+    toplevel = git_get_toplevel()
+    for _, _, path in sorted(candidates):
+        template_path = os.path.join(toplevel, path)
+        if os.path.isfile(template_path):
+            with open(template_path) as t:
+                return t.read()
 
 
 def edit_title_and_message(title, message):
+    if editor_hook is not None:
+        return editor_hook(title, message)
     fd, bodyfilename = tempfile.mkstemp()
     os.close(fd)
     with open(bodyfilename, "w") as body:
@@ -503,6 +1349,253 @@ def edit_title_and_message(title, message):
     return parse_pr_message(content)
 
 
+def git_get_stack(branch):
+    """Return the stack of local branches `branch` is built on.
+
+    The stack is discovered by following the upstream of each branch, as
+    long as it is a local branch other than a copy of the target branch.
+
+    :return: The branches, from the bottom of the stack to `branch`
+    """
+    stack = [branch]
+    while git_get_remote_for_branch(stack[0]) == ".":
+        parent = git_get_remote_branch_for_branch(stack[0])
+        if not parent or parent in stack:
+            break
+        if (
+            git_get_remote_for_branch(parent) not in ("", ".")
+            and git_get_remote_branch_for_branch(parent) == parent
+        ):
+            # The parent is a local copy of the target branch
+            break
+        stack.insert(0, parent)
+    return stack
+
+
+def _log_rebase_conflict():
+    LOG.error(
+        "It is likely that your change has a merge conflict.\n"
+        "You may resolve it in the working tree now as described "
+        "above.\n"
+        "Once done run `git pull-request' again.\n\n"
+        "If you want to abort conflict resolution, run "
+        "`git rebase --abort'.\n\n"
+        "Alternatively run `git pull-request -R' to upload the change "
+        "without rebase.\n"
+        "However the change won't able to merge until the conflict is "
+        "resolved."
+    )
+
+
+def git_merge_trees(base, ours, theirs):
+    """Apply the changes from `base` to `theirs` on `ours`, without worktree.
+
+    :return: The merged tree, or None on conflicts
+    """
+    try:
+        return _run_shell_command(
+            [
+                "git",
+                "merge-tree",
+                "--write-tree",
+                "--no-messages",
+                "--merge-base=" + base,
+                ours,
+                theirs,
+            ],
+            output=True,
+        ).split()[0]
+    except RuntimeError:
+        # Conflicts, or git older than 2.40: only merge the files changed
+        # on one side
+        pass
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(tmpdir, "index"))
+        try:
+            _run_shell_command(
+                ["git", "read-tree", "-i", "-m", "--aggressive", base, ours, theirs],
+                output=True,
+                env=env,
+            )
+            return _run_shell_command(["git", "write-tree"], output=True, env=env)
+        except RuntimeError:
+            return None
+
+
+def git_get_branch_worktree(branch):
+    """Return the path of the worktree where `branch` is checked out."""
+    path = None
+    for line in _stream_shell_command(["git", "worktree", "list", "--porcelain"]):
+        if line.startswith("worktree "):
+            path = line[9:]
+        elif line == "branch refs/heads/" + branch:
+            return path
+    return None
+
+
+def git_rebase_in_memory(onto, branch, upstream=None):
+    """Rebase `branch` on `onto` without checking it out.
+
+    Like `git rebase --onto <onto> <upstream> <branch>`, the commits of
+    `branch` not in `upstream` are replayed on `onto`, but without
+    touching the files of the worktree. If the branch is checked out in a
+    worktree, only the files changed by the rebase are updated there.
+
+    :param upstream: Where the commits to replay start, `onto` by default
+    :return: Whether the branch has been rebased, otherwise it needs a
+             classic rebase, e.g. to resolve conflicts
+    """
+    upstream = upstream or onto
+    ref = "refs/heads/" + branch
+    if _run_shell_command(
+        ["git", "rev-list", "--min-parents=2", "%s..%s" % (upstream, ref), "--"],
+        output=True,
+    ):
+        LOG.debug("Branch `%s' contains merge commits", branch)
+        return False
+    commits = _run_shell_command(
+        [
+            "git",
+            "rev-list",
+            "--reverse",
+            "--right-only",
+            "--cherry-pick",
+            "--no-merges",
+            "%s...%s" % (upstream, ref),
+            "--",
+        ],
+        output=True,
+    ).split()
+    revisions = [onto + "^{commit}", onto + "^{tree}", ref]
+    for commit in commits:
+        revisions += [commit + "^", commit + "^{tree}", commit + "^^{tree}"]
+    new, new_tree, old, *trees = _run_shell_command(
+        ["git", "rev-parse"] + revisions, output=True
+    ).split()
+
+    for i, commit in enumerate(commits):
+        parent, tree, parent_tree = trees[i * 3 : i * 3 + 3]
+        if parent == new:
+            # Already based on the rebased history
+            new, new_tree = commit, tree
+            continue
+        merged = git_merge_trees(parent, new, commit)
+        if merged is None:
+            LOG.debug("Commit %s does not apply cleanly", commit)
+            return False
+        if merged == new_tree and tree != parent_tree:
+            LOG.debug("Dropping commit %s, its changes are already applied", commit)
+            continue
+        name, email, date, message = _run_shell_command(
+            ["git", "show", "-s", "--date=raw", "--format=%an%x00%ae%x00%ad%x00%B"]
+            + [commit],
+            output=True,
+        ).split("\0", 3)
+        new = _run_shell_command(
+            ["git", "commit-tree", merged, "-p", new, "-m", message],
+            output=True,
+            env=dict(
+                os.environ,
+                GIT_AUTHOR_NAME=name,
+                GIT_AUTHOR_EMAIL=email,
+                GIT_AUTHOR_DATE=date,
+            ),
+        )
+        new_tree = merged
+
+    if new == old:
+        return True
+    worktree = git_get_branch_worktree(branch)
+    if worktree is not None:
+        try:
+            # Fails like `git rebase' on changes to the files to update
+            _run_shell_command(
+                ["git", "-C", worktree, "read-tree", "-m", "-u", old, new]
+            )
+        except RuntimeError:
+            return False
+    _run_shell_command(
+        ["git", "update-ref", "-m", "rebase in memory onto " + onto, ref, new, old]
+    )
+    return True
+
+
+def _run_in_background(func, *args):
+    """Run `func` in a thread not delaying the exit of the process."""
+    future = futures.Future()
+
+    def target():
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:  # noqa B902
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+def git_wait_for_repository(remote, timeout=120):
+    """Wait until the repository of `remote` can be reached.
+
+    Forges create forks asynchronously, so a new fork may not accept a
+    push right away.
+
+    :return: Whether the repository has been reached in time
+    """
+
+    def reachable():
+        try:
+            _run_shell_command(
+                git_network_command("ls-remote", "--heads", remote), output=True
+            )
+        except RuntimeError:
+            LOG.debug("Repository of remote `%s' is not ready yet", remote)
+            return False
+        return True
+
+    return backend.poll(reachable, timeout)
+
+
+def _log_fork_not_ready(remote):
+    LOG.critical(
+        "The forked repository of remote `%s' is still not ready, try again later",
+        remote,
+    )
+    return 47
+
+
+def git_push(remote, refspecs, mirror_remotes=()):
+    """Force-push `refspecs` to `remote` and, concurrently, to the mirrors.
+
+    A failure to push to `remote` raises, while the result of each mirror
+    is only reported.
+
+    :return: Whether all the mirrors have been pushed to
+    """
+    cmd = git_network_command("push", "--force")
+    if len(refspecs) > 1:
+        # Update the whole stack or nothing
+        cmd.append("--atomic")
+
+    jobs = {}
+    with futures.ThreadPoolExecutor(max(len(mirror_remotes), 1)) as executor:
+        for mirror in mirror_remotes:
+            job = executor.submit(_run_shell_command, cmd + [mirror] + refspecs)
+            jobs[job] = mirror
+        _run_shell_command(cmd + [remote] + refspecs)
+
+    pushed = True
+    for job, mirror in jobs.items():
+        try:
+            job.result()
+        except RuntimeError:
+            LOG.error("Unable to push to mirror remote `%s'", mirror)
+            pushed = False
+        else:
+            LOG.info("Pushed to mirror remote `%s'", mirror)
+    return pushed
+
+
 def fork_and_push_pull_request(
     g,
     hosttype,
@@ -521,9 +1614,23 @@ def fork_and_push_pull_request(
     branch_prefix,
     dry_run=False,
     labels=None,
+    stack=None,
+    max_body_size=BODY_MAX_LENGTH,
+    edit_message=True,
+    mirror_remotes=None,
+    rebase_in_memory=False,
+    edited=None,
 ):
+    """Push the branches and create or update their pull requests.
+
+    :param edited: A dict where the title and message written in the editor
+                   are stored by branch
+    """
     g_user = g.get_user()
 
+    # The branches to send, from the bottom of the stack
+    branches = (stack or []) + [branch]
+
     forked = False
     if fork in ["always", "auto"]:
         try:
@@ -552,10 +1659,14 @@ def fork_and_push_pull_request(
     if branch_prefix is None and not forked:
         branch_prefix = g_user.login
 
-    if branch_prefix:
-        remote_branch = "{}/{}".format(branch_prefix, branch)
-    else:
-        remote_branch = branch
+    fork_ready = None
+
+    remote_branches = {}
+    for b in branches:
+        if branch_prefix:
+            remote_branches[b] = "{}/{}".format(branch_prefix, b)
+        else:
+            remote_branches[b] = b
 
     if forked:
         remote_to_push = git_remote_matching_url(repo_forked.clone_url)
@@ -565,87 +1676,211 @@ def fork_and_push_pull_request(
                 "Found forked repository already in remote as `%s'", remote_to_push
             )
         else:
-            remote_to_push = hosttype
-            _run_shell_command(
-                ["git", "remote", "add", remote_to_push, repo_forked.clone_url]
-            )
-            LOG.info("Added forked repository as remote `%s'", remote_to_push)
-        head = "{}:{}".format(forked_repo_id.user, branch)
+            remote_to_push = git_add_remote(hosttype, repo_forked.clone_url)
+            if not dry_run:
+                # The fork may still be being created: wait for it while
+                # rebasing rather than failing to push
+                fork_ready = _run_in_background(git_wait_for_repository, remote_to_push)
+        # Pagure fork URLs do not contain the user
+        head_owner = forked_repo_id.user or g_user.login
+        heads = {b: "{}:{}".format(head_owner, b) for b in branches}
     else:
         remote_to_push = target_remote
-        head = "{}:{}".format(repo_to_fork.owner.login, remote_branch)
+        heads = {
+            b: "{}:{}".format(repo_to_fork.owner.login, remote_branches[b])
+            for b in branches
+        }
 
     if setup_only:
+        if fork_ready is not None and not fork_ready.result():
+            return _log_fork_not_ready(remote_to_push)
         LOG.info("Fetch existing branches of remote `%s`", remote_to_push)
-        _run_shell_command(["git", "fetch", remote_to_push])
+        _run_shell_command(git_network_command("fetch", remote_to_push))
         return
 
     if rebase:
-        _run_shell_command(["git", "remote", "update", target_remote])
-
-        LOG.info(
-            "Rebasing branch `%s' on branch `%s/%s'",
-            branch,
-            target_remote,
-            target_branch,
-        )
-        try:
-            _run_shell_command(
-                [
-                    "git",
-                    "rebase",
-                    "remotes/%s/%s" % (target_remote, target_branch),
-                    branch,
-                ]
-            )
-        except RuntimeError:
-            LOG.error(
-                "It is likely that your change has a merge conflict.\n"
-                "You may resolve it in the working tree now as described "
-                "above.\n"
-                "Once done run `git pull-request' again.\n\n"
-                "If you want to abort conflict resolution, run "
-                "`git rebase --abort'.\n\n"
-                "Alternatively run `git pull-request -R' to upload the change "
-                "without rebase.\n"
-                "However the change won't able to merge until the conflict is "
-                "resolved."
+        with results.timed("rebase"):
+            _run_shell_command(git_network_command("remote", "update", target_remote))
+
+            # Remember where each branch was to only replay its own commits
+            old_tips = _run_shell_command(
+                ["git", "rev-parse"] + branches, output=True
+            ).split("\n")
+            for i, b in enumerate(branches):
+                if i == 0:
+                    onto = "%s/%s" % (target_remote, target_branch)
+                    onto_ref = upstream = "remotes/" + onto
+                else:
+                    onto = onto_ref = branches[i - 1]
+                    upstream = old_tips[i - 1]
+                LOG.info("Rebasing branch `%s' on branch `%s'", b, onto)
+                if rebase_in_memory:
+                    if git_rebase_in_memory(onto_ref, b, upstream):
+                        continue
+                    LOG.info("Unable to rebase in memory, rebasing in the worktree")
+                cmd = ["git", "rebase", "--onto", onto_ref, upstream, b]
+                try:
+                    _run_shell_command(cmd)
+                except RuntimeError:
+                    _log_rebase_conflict()
+                    return 37
+
+    mirror_remotes = [m for m in mirror_remotes or [] if m != remote_to_push]
+    for remote in [remote_to_push] + mirror_remotes:
+        for b in branches:
+            LOG.info(
+                "%s branch `%s' to remote `%s/%s'",
+                "Would force-push" if dry_run else "Force-pushing",
+                b,
+                remote,
+                remote_branches[b],
             )
-            return 37
-
-    if dry_run:
-        LOG.info(
-            "Would force-push branch `%s' to remote `%s/%s'",
-            branch,
-            remote_to_push,
-            remote_branch,
-        )
-    else:
-        LOG.info(
-            "Force-pushing branch `%s' to remote `%s/%s'",
-            branch,
-            remote_to_push,
-            remote_branch,
-        )
-        _run_shell_command(
-            [
-                "git",
-                "push",
-                "--force",
-                remote_to_push,
-                "{}:{}".format(branch, remote_branch),
-            ]
+    if fork_ready is not None and not fork_ready.result():
+        return _log_fork_not_ready(remote_to_push)
+    mirrors_pushed = True
+    if not dry_run:
+        refspecs = ["{}:{}".format(b, remote_branches[b]) for b in branches]
+        with results.timed("push"):
+            mirrors_pushed = git_push(remote_to_push, refspecs, mirror_remotes)
+
+    for i, b in enumerate(branches):
+        if i == 0:
+            base = target_branch
+            git_base = "%s/%s" % (target_remote, target_branch)
+        else:
+            base = remote_branches[branches[i - 1]]
+            git_base = branches[i - 1]
+        if b == branch:
+            b_title, b_message = title, message
+        else:
+            b_title = b_message = None
+        retcode = create_or_update_pull_request(
+            repo_to_fork,
+            base,
+            heads[b],
+            git_base,
+            b,
+            b_title,
+            b_message,
+            keep_message,
+            comment,
+            dry_run,
+            labels,
+            max_body_size,
+            edit_message,
+            edited,
         )
+        if retcode:
+            return retcode
 
-    head_login, _, head_ref = head.partition(":")
-    pulls = list(
-        p
-        for p in repo_to_fork.get_pulls(base=target_branch)
-        if p.head.ref == head_ref and p.head.user.login == head_login
-    )
+    if not mirrors_pushed:
+        return 48
+
+
+@attr.s
+class PullRequestUpdate:
+    """Changes to send to an existing pull request.
+
+    The changes are collected first and then submitted with as few requests
+    as possible: on GitHub, title, body and labels are sent with a single
+    issue edit and the comment is posted directly on the pull request.
+    """
+
+    pull = attr.ib()
+    title = attr.ib(default=None)
+    body = attr.ib(default=None)
+    labels = attr.ib(factory=list)
+    comment = attr.ib(default=None)
+
+    def set_title(self, title):
+        if title and title != self.pull.title:
+            self.title = title
+
+    def set_body(self, body):
+        if body and body != self.pull.body:
+            self.body = body
+
+    def add_labels(self, labels):
+        present = {getattr(label, "name", label) for label in self.pull.labels}
+        for label in labels or []:
+            if label not in present and label not in self.labels:
+                self.labels.append(label)
+
+    def add_comment(self, comment):
+        self.comment = comment
+
+    def __bool__(self):
+        return bool(self.title or self.body or self.labels or self.comment)
+
+    def log(self):
+        """Log the changes instead of sending them."""
+        if self.title:
+            LOG.info("Would edit title")
+            LOG.info("%s\n", self.title)
+        if self.body:
+            LOG.info("Would edit body")
+            LOG.info("%s\n", self.body)
+        if self.comment:
+            LOG.info('Would comment: "%s"', self.comment)
+        if self.labels:
+            LOG.info("Would add labels %s", self.labels)
+
+    def submit(self):
+        if isinstance(self.pull, github.PullRequest.PullRequest):
+            self._submit_github()
+        else:
+            if self.title or self.body:
+                self.pull.edit(title=self.title, body=self.body)
+            if self.labels:
+                self.pull.add_to_labels(*self.labels)
+        if self.title or self.body:
+            LOG.debug("Updated pull-request title and body")
+        if self.labels:
+            LOG.debug("Added labels %s", self.labels)
+        if self.comment:
+            self.pull.create_issue_comment(self.comment)
+            LOG.debug('Commented: "%s"', self.comment)
+
+    def _submit_github(self):
+        kwargs = {}
+        if self.title:
+            kwargs["title"] = self.title
+        if self.body:
+            kwargs["body"] = self.body
+        if self.labels:
+            # The issue edit replaces the labels, so send the existing ones too
+            kwargs["labels"] = [label.name for label in self.pull.labels] + self.labels
+        if kwargs:
+            self.pull.as_issue().edit(**kwargs)
+
+
+def create_or_update_pull_request(
+    repo_to_fork,
+    base,
+    head,
+    git_base,
+    branch,
+    title,
+    message,
+    keep_message,
+    comment,
+    dry_run=False,
+    labels=None,
+    max_body_size=BODY_MAX_LENGTH,
+    edit_message=True,
+    edited=None,
+):
+    """Create or update the pull request from `head` to `base`.
+
+    :param git_base: The git revision `branch` is compared to
+    :param max_body_size: The maximum length of the generated message
+    :param edit_message: Whether to open an editor on the message
+    :param edited: A dict where the edited title and message are stored
+    """
+    pulls = find_pulls(repo_to_fork, base, head)
 
     nb_commits, git_title, git_message = git_get_title_and_message(
-        "%s/%s" % (target_remote, target_branch), branch
+        git_base, branch, max_body_size
     )
 
     if pulls:
@@ -665,6 +1900,8 @@ def fork_and_push_pull_request(
             if keep_message:
                 ptitle = pull.title
                 body = pull.body
+            elif not edit_message:
+                body = pull.body if message is None else message
             else:
                 body = textparse.concat_with_ignore_marker(
                     message or git_message,
@@ -675,60 +1912,42 @@ def fork_and_push_pull_request(
                 )
 
                 ptitle, body = edit_title_and_message(ptitle, body)
+                if edited is not None:
+                    edited[branch] = ptitle, body
 
             if ptitle is None:
                 LOG.critical("Pull-request message is empty, aborting")
                 return 40
 
-            if ptitle == pull.title and body == pull.body:
-                LOG.debug("Pull-request title and body is already up to date")
-            elif ptitle and body:
-                if dry_run:
-                    LOG.info("Would edit title and body")
-                    LOG.info("%s\n", ptitle)
-                    LOG.info("%s", body)
-                else:
-                    pull.edit(title=ptitle, body=body)
-                    LOG.debug("Updated pull-request title and body")
-            elif ptitle:
-                if dry_run:
-                    LOG.info("Would edit title")
-                    LOG.info("%s\n", ptitle)
-                else:
-                    pull.edit(title=ptitle)
-                    LOG.debug("Updated pull-request title")
-            elif body:
-                if dry_run:
-                    LOG.info("Would edit body")
-                    LOG.info("%s\n", body)
-                else:
-                    pull.edit(body=body)
-                    LOG.debug("Updated pull-request body")
-
-            if comment:
-                if dry_run:
-                    LOG.info('Would comment: "%s"', comment)
-                else:
-                    # FIXME(jd) we should be able to comment directly on a PR
-                    # without getting it as an issue but pygithub does not
-                    # allow that yet
-                    repo_to_fork.get_issue(pull.number).create_comment(comment)
-                    LOG.debug('Commented: "%s"', comment)
-
-            if labels:
-                if dry_run:
-                    LOG.info("Would add labels %s", labels)
-                else:
-                    LOG.debug("Adding labels %s", labels)
-                    pull.add_to_labels(*labels)
+            update = PullRequestUpdate(pull)
+            update.set_title(ptitle)
+            update.set_body(body)
+            update.add_comment(comment)
+            update.add_labels(labels)
+            if not update:
+                LOG.debug("Pull-request is already up to date")
+                action = "up-to-date"
+            elif dry_run:
+                update.log()
+                action = "would-update"
+            else:
+                update.submit()
+                action = "updated"
 
             LOG.info("Pull-request updated: %s", pull.html_url)
+            _add_result(repo_to_fork, action, branch, pull)
     else:
         # Create a pull request
         if not title or not message:
             title = title or git_title
             message = message or git_message
-            title, message = edit_title_and_message(title, message)
+            if edit_message:
+                title, message = edit_title_and_message(title, message)
+                if edited is not None:
+                    edited[branch] = title, message
+            else:
+                # What follows the marker is only meant for the editor
+                message = textparse.remove_ignore_marker(message)
 
         if title is None:
             LOG.critical("Pull-request message is empty, aborting")
@@ -738,11 +1957,12 @@ def fork_and_push_pull_request(
             LOG.info("Pull-request would be created.")
             LOG.info("Title: %s", title)
             LOG.info("Body: %s", message)
+            _add_result(repo_to_fork, "would-create", branch)
             return
 
         try:
             pull = repo_to_fork.create_pull(
-                base=target_branch, head=head, title=title, body=message
+                base=base, head=head, title=title, body=message
             )
         except github.GithubException as e:
             LOG.critical(_format_github_exception("create pull request", e))
@@ -751,8 +1971,36 @@ def fork_and_push_pull_request(
             LOG.info("Pull-request created: %s", pull.html_url)
 
         if labels:
-            LOG.debug("Adding labels %s", labels)
-            pull.add_to_labels(*labels)
+            update = PullRequestUpdate(pull)
+            update.add_labels(labels)
+            update.submit()
+        _add_result(repo_to_fork, "created", branch, pull)
+
+
+def _add_result(repo, action, branch, pull=None):
+    if not results.enabled:
+        return
+    results.add(
+        action,
+        # PyGithub requests are not counted
+        count_requests=not isinstance(repo, github.Repository.Repository),
+        url=pull.html_url if pull else None,
+        number=pull.number if pull else None,
+        branch=branch,
+        head=_run_shell_command(
+            ["git", "rev-parse", "refs/heads/" + branch], output=True
+        ),
+    )
+
+
+def find_pulls(repo, base, head):
+    """Return the pull requests from `head` (user:branch) to `base`."""
+    head_login, _, head_ref = head.partition(":")
+    return [
+        p
+        for p in repo.get_pulls(base=base)
+        if p.head.ref == head_ref and p.head.user.login == head_login
+    ]
 
 
 def _format_github_exception(action, exc):
@@ -770,6 +2018,8 @@ def _format_github_exception(action, exc):
 
 class DownloadAndSetupAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_strings=None):
+        if not isinstance(values, list):
+            values = [values]
         setattr(namespace, "download", values)
         if self.dest == "download":
             setattr(namespace, "download_setup", False)
@@ -783,8 +2033,11 @@ def build_parser():
         "--download",
         "-d",
         type=int,
+        nargs="+",
         action=DownloadAndSetupAction,
-        help="Checkout a pull request",
+        help="Checkout a pull request. "
+        "When several pull requests are given, each one is checked out "
+        "in its own worktree.",
     )
     parser.add_argument(
         "--download-and-setup",
@@ -836,6 +2089,14 @@ def build_parser():
         action="store_true",
         help="Don't rebase branch before pushing.",
     )
+    git_config_add_argument(
+        parser,
+        "--rebase-in-memory",
+        action="store_true",
+        help="Rebase without checking out the branch, only updating the "
+        "files changed by the rebase. Fall back to a classic rebase on "
+        "conflicts.",
+    )
     parser.add_argument(
         "--comment", "-C", help="Comment to publish when updating the pull-request"
     )
@@ -860,6 +2121,114 @@ def build_parser():
         const="never",
         help="Don't fork to create the pull-request",
     )
+    git_config_add_argument(
+        parser,
+        "--max-body-size",
+        type=int,
+        default=BODY_MAX_LENGTH,
+        help="Maximum size of the generated pull request message. Commits "
+        "beyond it are only counted. Default is GitHub's limit.",
+    )
+    git_config_add_argument(
+        parser,
+        "--offline",
+        action="store_true",
+        help="Do not push nor send the pull request, queue it to send it "
+        "later with --flush.",
+    )
+    git_config_add_argument(
+        parser,
+        "--queue-on-error",
+        action="store_true",
+        help="Queue the pull request to send it later with --flush when "
+        "the forge cannot be reached.",
+    )
+    parser.add_argument(
+        "--flush",
+        action="store_true",
+        help="Send the queued pull requests.",
+    )
+    git_config_add_argument(
+        parser,
+        "--stack",
+        action="store_true",
+        help="Send a pull request for each branch of the stack the current "
+        "branch is built on. Each branch must track the one below it.",
+    )
+    git_config_add_argument(
+        parser,
+        "--worktree",
+        action="store_true",
+        help="Check out a downloaded pull request in its own worktree, "
+        "leaving the current one alone.",
+    )
+    git_config_add_argument(
+        parser,
+        "--sparse",
+        action="store_true",
+        help="Check out downloaded pull requests in their own worktree, "
+        "with only the directories they change.",
+    )
+    git_config_add_argument(
+        parser,
+        "--worktree-dir",
+        help="Directory where pull requests worktrees are created. "
+        "Default is the repository directory suffixed with `-pulls'.",
+    )
+    git_config_add_argument(
+        parser,
+        "--connect-timeout",
+        type=float,
+        default=timeouts.CONNECT_TIMEOUT,
+        help="Seconds to wait for a connection to the forge. Default is %(default)s.",
+    )
+    git_config_add_argument(
+        parser,
+        "--read-timeout",
+        type=float,
+        default=timeouts.READ_TIMEOUT,
+        help="Seconds to wait for data from the forge or a git remote. "
+        "Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="Seconds the whole run may take. Past it, abort and report what "
+        "was running.",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        dest="list_pulls",
+        help="List the open pull requests of the target repository. "
+        "With --offline, only show what was listed last time.",
+    )
+    parser.add_argument(
+        "--watch",
+        "-w",
+        action="store_true",
+        help="Keep running and push the branch again each time it changes.",
+    )
+    parser.add_argument(
+        "--mirror-remote",
+        action="append",
+        default=git_get_config_all("git-pull-request.mirror-remote"),
+        help="Remote to also force-push the branch to, e.g. a mirror used by "
+        "a CI. Can be used multiple times, in addition to the "
+        "git-pull-request.mirror-remote configuration values.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Write a JSON object per pull request on stdout, with its URL, "
+        "number, the action taken, the pushed commit, timings and the number "
+        "of forge requests. Logs are written on stderr.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run a daemon serving the next invocations with warm clients.",
+    )
     git_config_add_argument(
         parser,
         "--setup-only",
@@ -870,22 +2239,33 @@ def build_parser():
     return parser
 
 
-def main():
-    args = build_parser().parse_args()
+def _write_to_stderr(text):
+    sys.stderr.write(text + "\n")
+    sys.stderr.flush()
+
+
+def run(args):
+    global child_output
+
+    timeouts.configure(args.connect_timeout, args.read_timeout, args.deadline)
+    results.configure(args.json)
+    backend.forget_responses()
+    forwarded = child_output
+    if args.json and child_output is None:
+        child_output = _write_to_stderr
+    try:
+        retcode = _run(args)
+    finally:
+        child_output = forwarded
+    if args.json:
+        results.dump(sys.stdout, retcode)
+    return retcode
 
-    daiquiri.setup(
-        outputs=(
-            daiquiri.output.Stream(
-                sys.stdout,
-                formatter=daiquiri.formatter.ColorFormatter(
-                    fmt="%(color)s%(message)s%(color_stop)s"
-                ),
-            ),
-        ),
-        level=logging.DEBUG if args.debug else logging.INFO,
-    )
 
+def _run(args):
     try:
+        if args.flush:
+            return flush_pull_requests(args.dry_run)
         return git_pull_request(
             target_remote=args.target_remote,
             target_branch=args.target_branch,
@@ -901,11 +2281,105 @@ def main():
             branch_prefix=args.branch_prefix,
             dry_run=args.dry_run,
             labels=args.label,
+            worktree_dir=args.worktree_dir,
+            stack=args.stack,
+            max_body_size=args.max_body_size,
+            offline=args.offline,
+            queue_on_error=args.queue_on_error,
+            watch=args.watch,
+            list_pulls=args.list_pulls,
+            mirror_remotes=args.mirror_remote,
+            rebase_in_memory=args.rebase_in_memory,
+            worktree=args.worktree,
+            sparse=args.sparse,
         )
+    except timeouts.DeadlineExceeded as e:
+        LOG.critical("%s", e)
+        return 60
+    except requests.exceptions.Timeout:
+        if timeouts.expired():
+            LOG.critical("%s", timeouts.DeadlineExceeded("talking to the forge"))
+            return 60
+        LOG.error("Unable to send pull request", exc_info=True)
+        return 128
     except Exception:  # noqa B902
         LOG.error("Unable to send pull request", exc_info=True)
         return 128
 
 
+def _get_formatter():
+    return daiquiri.formatter.ColorFormatter(fmt="%(color)s%(message)s%(color_stop)s")
+
+
+def _must_run_locally(args):
+    # A watch would keep the daemon busy until it is stopped, and the
+    # daemon only sends back logs
+    return args.daemon or args.watch or args.json
+
+
+def _run_in_daemon(argv, connection):
+    global editor_hook, child_output, credential_prompt
+
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            args = build_parser().parse_args(argv)
+    except SystemExit as e:
+        connection.send(log=output.getvalue().rstrip("\n"))
+        return e.code
+    if _must_run_locally(args):
+        connection.send(log="--daemon, --watch and --json cannot be run by the daemon")
+        return 2
+
+    handler = daemon.LogHandler(connection)
+    handler.setFormatter(_get_formatter())
+    root = logging.getLogger()
+    level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.DEBUG if args.debug else logging.INFO)
+    editor_hook = connection.edit_title_and_message
+    child_output = connection.send_log
+    credential_prompt = False
+    # The environment is restored by the daemon after the run
+    os.environ["GIT_TERMINAL_PROMPT"] = "0"
+    try:
+        retcode = run(args)
+    finally:
+        editor_hook = None
+        child_output = None
+        credential_prompt = True
+        root.removeHandler(handler)
+        root.setLevel(level)
+    if retcode:
+        # Credentials may have been revoked, do not keep them
+        _CREDENTIALS.clear()
+        _CLIENTS.clear()
+    return retcode
+
+
+def main():
+    argv = sys.argv[1:]
+    args = build_parser().parse_args(argv)
+
+    if not _must_run_locally(args):
+        retcode = daemon.call(argv, edit_title_and_message)
+        if retcode is not None:
+            return retcode
+
+    daiquiri.setup(
+        outputs=(
+            daiquiri.output.Stream(
+                sys.stderr if args.json else sys.stdout, formatter=_get_formatter()
+            ),
+        ),
+        level=logging.DEBUG if args.debug else logging.INFO,
+    )
+
+    if args.daemon:
+        return daemon.serve(_run_in_daemon)
+
+    return run(args)
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,196 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import abc
+import time
+
+import attr
+import daiquiri
+import requests
+
+from git_pull_request import results
+from git_pull_request import timeouts
+
+
+LOG = daiquiri.getLogger("git-pull-request")
+
+
+# Successful responses to the GET requests sent during the run
+_responses = {}
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def forget_responses():
+    """Send the next GET requests again, e.g. at the start of a run."""
+    _responses.clear()
+
+
+def send(method, url, session=requests, **kwargs):
+    """Send a request within the configured timeouts.
+
+    Identical GET requests, including their parameters and credentials,
+    are only sent once until a request of another method is sent, which
+    may change what they return.
+    """
+    if method == "GET":
+        key = (url, _freeze(kwargs))
+        if key in _responses:
+            LOG.debug("Reusing the response of GET %s", url)
+            return _responses[key]
+    else:
+        _responses.clear()
+
+    phase = "sending %s %s" % (method, url)
+    results.count_request()
+    try:
+        resp = session.request(method, url, timeout=timeouts.get(phase), **kwargs)
+    except requests.exceptions.Timeout as e:
+        if timeouts.expired():
+            raise timeouts.DeadlineExceeded(phase) from e
+        raise
+    if method == "GET" and resp.ok:
+        _responses[key] = resp
+    return resp
+
+
+def poll(check, timeout=60, delay=0.5, max_delay=8):
+    """Call `check` until it returns a true value, with exponential backoff.
+
+    :return: The last value returned by `check`
+    """
+    end = time.monotonic() + timeout
+    while True:
+        result = check()
+        left = end - time.monotonic()
+        if timeouts.remaining() is not None:
+            left = min(left, timeouts.remaining())
+        if result or left <= 0:
+            return result
+        time.sleep(min(delay, left))
+        delay = min(delay * 2, max_delay)
+
+
+@attr.s(slots=True, frozen=True)
+class User:
+    login = attr.ib(type=str)
+
+
+@attr.s(slots=True, frozen=True)
+class Fork:
+    clone_url = attr.ib(type=str)
+    html_url = attr.ib(type=str)
+
+
+@attr.s(slots=True, frozen=True)
+class Ref:
+    ref = attr.ib(type=str)
+    user = attr.ib(type=User)
+    repo = attr.ib(type=Fork, default=None)
+
+
+@attr.s(slots=True, eq=False)
+class PullRequest:
+    client = attr.ib(repr=False)
+    number = attr.ib(type=int)
+    title = attr.ib(type=str)
+    body = attr.ib(type=str)
+    html_url = attr.ib(type=str)
+    user = attr.ib(type=User)
+    head = attr.ib(type=Ref)
+    base = attr.ib(type=Ref)
+    labels = attr.ib(factory=list)
+
+    def edit(self, title=None, body=None):
+        self.client.edit_pull(self, title=title, body=body)
+
+    def create_issue_comment(self, body):
+        self.client.create_comment(self.number, body)
+
+    def add_to_labels(self, *labels):
+        self.client.add_to_labels(self, *labels)
+
+
+@attr.s(slots=True, frozen=True)
+class Repository:
+    client = attr.ib(repr=False)
+    name = attr.ib(type=str)
+    owner = attr.ib(type=User)
+
+    def get_pulls(self, base):
+        return self.client.get_pulls(base)
+
+    def get_pull(self, number):
+        return self.client.get_pull(number)
+
+    def create_pull(self, base, head, title, body):
+        return self.client.create_pull(base, head, title, body)
+
+
+@attr.s(slots=True, frozen=True)
+class AuthenticatedUser:
+    client = attr.ib(repr=False)
+    login = attr.ib(type=str)
+
+    def create_fork(self, repo):
+        return self.client.create_fork(repo)
+
+
+class Client(abc.ABC):
+    """Base of the forge clients loosely compatible with the GitHub client.
+
+    Subclasses implement the forge operations, while the objects returned by
+    `get_user` and `get_repo` expose them like PyGithub objects do.
+    """
+
+    user = None
+
+    def get_user(self):
+        return AuthenticatedUser(self, self.user)
+
+    def get_repo(self, reponame):
+        return Repository(self, reponame, User(self.user))
+
+    @abc.abstractmethod
+    def create_fork(self, repo):
+        """Fork the repository and return a `Fork`."""
+
+    @abc.abstractmethod
+    def get_pulls(self, base):
+        """Return the open `PullRequest` of the user targeting `base`."""
+
+    @abc.abstractmethod
+    def get_pull(self, number):
+        """Return the `PullRequest` numbered `number`."""
+
+    @abc.abstractmethod
+    def create_pull(self, base, head, title, body):
+        """Create a pull request and return it as a `PullRequest`."""
+
+    def edit_pull(self, pull, title=None, body=None):
+        self.todo()
+
+    def create_comment(self, number, body):
+        self.todo()
+
+    def add_to_labels(self, pull, *labels):
+        LOG.warning("Adding labels is not implemented yet")
+
+    @staticmethod
+    def todo(*args, **kwargs):
+        LOG.warning("Updating title or adding comment is not implemented yet")
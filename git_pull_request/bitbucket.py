@@ -14,15 +14,17 @@
 import daiquiri
 import requests
 
+from git_pull_request import backend
+
 
 LOG = daiquiri.getLogger("git-pull-request")
 
 
 def is_bitbucket(hostname):
-    return requests.get("https://api.%s/2.0/repositories/" % hostname).ok
+    return backend.send("GET", "https://api.%s/2.0/repositories/" % hostname).ok
 
 
-class Client:
+class Client(backend.Client):
     """Bitbucket interface loosely compatible with the github client."""
 
     def __init__(self, hostname, user, password, user_to_fork, reponame_to_fork):
@@ -37,6 +39,10 @@ class Client:
             self.user_to_fork,
             self.reponame_to_fork,
         )
+        self.pulls_path = "repositories/%s/%s/pullrequests" % (
+            self.user_to_fork,
+            self.reponame_to_fork,
+        )
         self.session = requests.session()
 
     def create_fork(self, _):
@@ -52,10 +58,6 @@ class Client:
     def create_pull(self, base, head, title, body):
         branch_from = head.split(":", 1)[1]
 
-        endpoint = "repositories/%s/%s/pullrequests" % (
-            self.user_to_fork,
-            self.reponame_to_fork,
-        )
         data = dict(
             description=body,
             title=title,
@@ -66,20 +68,7 @@ class Client:
                 repository=dict(full_name="%s/%s" % (self.user, self.reponame_to_fork)),
             ),
         )
-        resp = self.post(
-            endpoint,
-            data=data,
-        )
-
-        class Pull:
-            html_url = "https://%s/%s/%s/pull-requests/%d" % (
-                self.host,
-                self.user_to_fork,
-                self.reponame_to_fork,
-                resp["id"],
-            )
-
-        return Pull
+        return self._make_pull(self.post(self.pulls_path, data=data))
 
     def get(self, endpoint, params=None, error_ok=False):
         return self.request("GET", endpoint, params=params, error_ok=error_ok)
@@ -91,94 +80,49 @@ class Client:
         for clone in clones:
             urls[clone.get("name")] = clone.get("href")
 
-        return type(
-            "ForkedRepo",
-            (object,),
-            dict(clone_url=urls["ssh"], html_url=urls["https"]),
+        return backend.Fork(clone_url=urls["ssh"], html_url=urls["https"])
+
+    def _make_pull(self, pull):
+        return backend.PullRequest(
+            client=self,
+            number=pull["id"],
+            title=pull["title"],
+            body=pull.get("summary", {}).get("raw", ""),
+            html_url="https://%s/%s/%s/pull-requests/%d"
+            % (self.host, self.user_to_fork, self.reponame_to_fork, pull["id"]),
+            user=backend.User(self.user),
+            head=backend.Ref(pull["source"]["branch"]["name"], backend.User(self.user)),
+            base=backend.Ref(
+                pull["destination"]["branch"]["name"],
+                backend.User(self.user_to_fork),
+            ),
         )
 
-    def get_issue(self, x):
-        class Issue:
-            create_comment = self.todo
-
-        return Issue
-
     def get_pull(self, pull_number):
-        class PullObject:
-            class user:
-                login = self.user
-
-            class head:
-                ref = "head"
-
-            number = pull_number
-
-        return PullObject
-
-    def get_pulls(self, base, head=None):
-        class Pull:
-            edit = self.todo
-            host = self.host
-            repo = "%s/%s" % (self.user_to_fork, self.reponame_to_fork)
-            body = ""
-
-            class head:
-                ref = "head"
-
-                class user:
-                    login = self.user
-
-            def __init__(self, number, title, ref, body):
-                self.html_url = "https://%s/%s/pull-requests/%d" % (
-                    self.host,
-                    self.repo,
-                    number,
-                )
-                self.body = body
-                self.number = number
-                self.title = title
-                self.head.ref = ref
-
-        endpoint = "repositories/%s/%s/pullrequests" % (
-            self.user_to_fork,
-            self.reponame_to_fork,
-        )
-        params = {"q": 'author.account_id="%s" AND state="OPEN"' % self.account_id}
-        pulls = self.get(endpoint, params=params)["values"]
-        res = []
-        for pull in pulls:
-            body = pull["summary"]["raw"]
-            ref = pull["source"]["branch"]["name"]
-            res.append(Pull(pull["id"], pull["title"], ref, body))
-
-        return res
-
-    def get_repo(self, reponame_to_fork):
-        class Repo:
-            class owner:
-                login = self.user
-
-            create_pull = self.create_pull
-            get_pulls = self.get_pulls
-            get_pull = self.get_pull
-            get_issue = self.get_issue
-
-        return Repo
-
-    # Shim layer to look like a github client
-    def get_user(self):
-        class User:
-            create_fork = self.create_fork
-
-        return User
+        return self._make_pull(self.get("%s/%d" % (self.pulls_path, pull_number)))
+
+    def get_pulls(self, base):
+        params = {
+            "q": 'author.account_id="%s" AND state="OPEN" '
+            'AND destination.branch.name="%s"' % (self.account_id, base)
+        }
+        return [
+            self._make_pull(pull)
+            for pull in self.get(self.pulls_path, params=params)["values"]
+        ]
 
     def post(self, endpoint, data=None):
         return self.request("POST", endpoint, json=data)
 
     def request(self, method, endpoint, json=None, params=None, error_ok=False):
         url = "https://api.%s/2.0/%s" % (self.host, endpoint)
-        resp = self.session.request(
-            method, url, json=json, auth=(self.user, self.password), params=params
+        resp = backend.send(
+            method,
+            url,
+            self.session,
+            json=json,
+            auth=(self.user, self.password),
+            params=params,
         )
         if not resp.ok:
             if resp.status_code == 401:
@@ -190,7 +134,3 @@ class Client:
                 )
             return False
         return resp.json()
-
-    @staticmethod
-    def todo(*args, **kwargs):
-        LOG.warning("Updating title or adding comment is not implemented yet")
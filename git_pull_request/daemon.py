@@ -0,0 +1,188 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+
+import daiquiri
+
+
+LOG = daiquiri.getLogger("git-pull-request")
+
+
+def get_socket_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "git-pull-request.sock")
+    return os.path.join(tempfile.gettempdir(), "git-pull-request-%d.sock" % os.getuid())
+
+
+class Connection:
+    """JSON lines channel between the daemon and a client."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        # Commands may run in threads, e.g. to push to mirrors
+        self._lock = threading.Lock()
+
+    def send(self, **message):
+        with self._lock:
+            self.wfile.write(json.dumps(message).encode() + b"\n")
+            self.wfile.flush()
+
+    def send_log(self, text):
+        self.send(log=text)
+
+    def receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("Connection closed")
+        return json.loads(line)
+
+    def edit_title_and_message(self, title, message):
+        """Have the client run the editor."""
+        self.send(edit=[title, message])
+        reply = self.receive()
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return tuple(reply["edited"])
+
+
+class LogHandler(logging.Handler):
+    """Send log records to the client."""
+
+    def __init__(self, connection):
+        super().__init__()
+        self.connection = connection
+
+    def emit(self, record):
+        try:
+            self.connection.send_log(self.format(record))
+        except OSError:
+            self.handleError(record)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        connection = Connection(self.rfile, self.wfile)
+        request = connection.receive()
+        cwd = os.getcwd()
+        environ = os.environ.copy()
+        try:
+            os.chdir(request["cwd"])
+            for key in list(os.environ):
+                if key.startswith("GIT_"):
+                    del os.environ[key]
+            os.environ.update(request["env"])
+            retcode = self.server.run(request["argv"], connection)
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(environ)
+        connection.send(retcode=retcode or 0)
+
+
+class Server(socketserver.UnixStreamServer):
+    """Run git-pull-request invocations one at a time in a warm process."""
+
+    def __init__(self, path, run):
+        self.run = run
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+def serve(run, path=None):
+    """Serve invocations until interrupted.
+
+    :param run: Callable receiving the command line arguments and the client
+                connection, and returning the exit code
+    :param path: The Unix socket path
+    """
+    path = path or get_socket_path()
+    with Server(path, run) as server:
+        LOG.info("Listening on `%s'", path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+def call(argv, edit_title_and_message, path=None):
+    """Run an invocation in the daemon.
+
+    :param argv: The command line arguments
+    :param edit_title_and_message: Callable running the editor locally
+    :param path: The Unix socket path
+    :return: The exit code, or None if the daemon is not running
+    """
+    path = path or get_socket_path()
+    try:
+        if os.stat(path).st_uid != os.getuid():
+            LOG.warning("Ignoring daemon socket `%s' owned by another user", path)
+            return None
+    except FileNotFoundError:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock, sock.makefile("rb") as rfile, sock.makefile("wb") as wfile:
+        connection = Connection(rfile, wfile)
+        connection.send(
+            argv=argv,
+            cwd=os.getcwd(),
+            env={k: v for k, v in os.environ.items() if k.startswith("GIT_")},
+        )
+        while True:
+            try:
+                message = connection.receive()
+            except ConnectionError:
+                LOG.error("The daemon closed the connection unexpectedly")
+                return 128
+            if "log" in message:
+                sys.stdout.write(message["log"] + "\n")
+                sys.stdout.flush()
+            elif "edit" in message:
+                try:
+                    edited = edit_title_and_message(*message["edit"])
+                except RuntimeError as e:
+                    connection.send(error=str(e))
+                else:
+                    connection.send(edited=edited)
+            elif "retcode" in message:
+                return message["retcode"]
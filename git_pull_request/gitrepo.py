@@ -0,0 +1,376 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Read the configuration and the references of a repository without git.
+
+Only the common layouts are supported: anything else raises `Unsupported`
+so that the caller can ask git instead. This covers conditional includes,
+the environment variables changing where git looks for the repository or
+its configuration, repositories owned by another user and the reftable
+format.
+
+The system configuration is read from /etc/gitconfig, where most
+distributions install it.
+"""
+
+import os
+import re
+
+
+SYSTEM_CONFIG = "/etc/gitconfig"
+
+# Variables changing how git finds the repository, its configuration or refs
+_ENVIRONMENT = (
+    "GIT_CEILING_DIRECTORIES",
+    "GIT_COMMON_DIR",
+    "GIT_CONFIG",
+    "GIT_CONFIG_COUNT",
+    "GIT_CONFIG_GLOBAL",
+    "GIT_CONFIG_PARAMETERS",
+    "GIT_CONFIG_SYSTEM",
+    "GIT_DIR",
+    "GIT_DISCOVERY_ACROSS_FILESYSTEM",
+    "GIT_NAMESPACE",
+    "GIT_WORK_TREE",
+)
+
+# References stored in the worktree git directory rather than the common one
+_PER_WORKTREE_REFS = ("refs/bisect/", "refs/rewritten/", "refs/worktree/")
+
+_MAX_INCLUDE_DEPTH = 10
+
+_SHA_RE = re.compile(r"^([0-9a-f]{40}|[0-9a-f]{64})$")
+
+# Only these references outside of refs/, like HEAD, are read by git
+_PSEUDO_REF_RE = re.compile(r"^[A-Z_-]+$")
+
+
+class Unsupported(Exception):
+    """The repository needs to be read by git."""
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        content = f.read()
+    try:
+        return content.decode()
+    except UnicodeDecodeError:
+        raise Unsupported("`%s' is not UTF-8" % path)
+
+
+def _skip_line(text, i):
+    end = text.find("\n", i)
+    return len(text) if end == -1 else end + 1
+
+
+_SECTION_RE = re.compile(r"\[([A-Za-z0-9.-]+)")
+
+
+def _parse_section(text, i):
+    """Parse a section header starting at `text[i]` == "["."""
+    match = _SECTION_RE.match(text, i)
+    if not match:
+        raise Unsupported("Invalid section header")
+    i = match.end()
+    name = match.group(1)
+    if text.startswith("]", i):
+        if "." in name:
+            # Deprecated [section.subsection] syntax
+            section, _, subsection = name.partition(".")
+            return "%s.%s" % (section.lower(), subsection.lower()), i + 1
+        return name.lower(), i + 1
+
+    while i < len(text) and text[i] in " \t":
+        i += 1
+    if not text.startswith('"', i):
+        raise Unsupported("Invalid section header")
+    i += 1
+    subsection = []
+    while i < len(text) and text[i] != '"':
+        if text[i] == "\n":
+            raise Unsupported("Invalid section header")
+        if text[i] == "\\":
+            i += 1
+        subsection.append(text[i])
+        i += 1
+    if not text.startswith('"]', i):
+        raise Unsupported("Invalid section header")
+    return "%s.%s" % (name.lower(), "".join(subsection)), i + 2
+
+
+_ESCAPES = {"\\": "\\", '"': '"', "n": "\n", "t": "\t", "b": "\b"}
+
+
+def _parse_value(text, i):
+    value = []
+    spaces = 0
+    quoted = False
+    while i < len(text):
+        c = text[i]
+        if c == "\n":
+            if quoted:
+                raise Unsupported("Unterminated quoted value")
+            i += 1
+            break
+        if not quoted and c in " \t\r":
+            spaces += 1
+            i += 1
+            continue
+        if not quoted and c in "#;":
+            i = _skip_line(text, i)
+            break
+        if value:
+            value.append(" " * spaces)
+        spaces = 0
+        if c == '"':
+            quoted = not quoted
+            i += 1
+        elif c == "\\":
+            if text.startswith("\n", i + 1):
+                i += 2
+            elif text.startswith("\r\n", i + 1):
+                i += 3
+            elif text[i + 1 : i + 2] in _ESCAPES:
+                value.append(_ESCAPES[text[i + 1]])
+                i += 2
+            else:
+                raise Unsupported("Invalid escape sequence")
+        else:
+            value.append(c)
+            i += 1
+    if quoted:
+        raise Unsupported("Unterminated quoted value")
+    return "".join(value), i
+
+
+_KEY_RE = re.compile(r"([A-Za-z][A-Za-z0-9-]*)[ \t]*")
+
+
+def parse_config(text):
+    """Yield the (key, value) entries of a configuration file content.
+
+    Section and variable names are lowercased as `git config` shows them.
+    The value of a variable without "=" is None.
+    """
+    section = None
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c in " \t\r\n":
+            i += 1
+        elif c in "#;":
+            i = _skip_line(text, i)
+        elif c == "[":
+            section, i = _parse_section(text, i)
+        else:
+            match = _KEY_RE.match(text, i)
+            if section is None or not match:
+                raise Unsupported("Invalid configuration line")
+            key = "%s.%s" % (section, match.group(1).lower())
+            i = match.end()
+            if text.startswith("=", i):
+                value, i = _parse_value(text, i + 1)
+            elif i == len(text) or text[i] in "\r\n#;":
+                value = None
+            else:
+                raise Unsupported("Invalid configuration line")
+            yield key, value
+
+
+def normalize_key(key):
+    """Lowercase the section and variable names of `key`."""
+    section, _, rest = key.partition(".")
+    subsection, _, name = rest.rpartition(".")
+    if subsection:
+        return "%s.%s.%s" % (section.lower(), subsection, name.lower())
+    return "%s.%s" % (section.lower(), name.lower())
+
+
+def _is_true(value):
+    return value is None or value.lower() in ("true", "yes", "on", "1")
+
+
+def _read_config(path, depth=0):
+    try:
+        text = _read(path)
+    except FileNotFoundError:
+        return
+    for key, value in parse_config(text):
+        if key.startswith("includeif."):
+            raise Unsupported("Conditional includes are not supported")
+        yield key, value
+        if key == "include.path" and value:
+            if depth >= _MAX_INCLUDE_DEPTH:
+                raise Unsupported("Too many nested includes")
+            include = os.path.expanduser(value)
+            if not os.path.isabs(include):
+                include = os.path.join(os.path.dirname(path), include)
+            yield from _read_config(include, depth + 1)
+
+
+class Repository:
+    """Reader of a repository configuration and references."""
+
+    def __init__(self, git_dir, common_dir):
+        self.git_dir = git_dir
+        self.common_dir = common_dir
+        self._config = None
+        self._packed_refs = None
+
+    @classmethod
+    def discover(cls, path=None):
+        """Find the repository containing `path`, or the current directory."""
+        for name in _ENVIRONMENT:
+            if name in os.environ:
+                raise Unsupported("%s is set" % name)
+
+        path = os.path.abspath(path or os.getcwd())
+        while True:
+            if os.path.isfile(os.path.join(path, "HEAD")) and os.path.isdir(
+                os.path.join(path, "objects")
+            ):
+                raise Unsupported("Bare repositories are not supported")
+            dotgit = os.path.join(path, ".git")
+            if os.path.isdir(dotgit):
+                git_dir = dotgit
+                break
+            if os.path.isfile(dotgit):
+                content = _read(dotgit).strip()
+                if not content.startswith("gitdir: "):
+                    raise Unsupported("Invalid .git file")
+                git_dir = os.path.join(path, content[8:])
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise Unsupported("Not in a git repository")
+            path = parent
+
+        if os.stat(path).st_uid != os.geteuid():
+            # Let git decide whether the repository is safe
+            raise Unsupported("Repository owned by another user")
+
+        git_dir = os.path.normpath(git_dir)
+        try:
+            common_dir = os.path.join(
+                git_dir, _read(os.path.join(git_dir, "commondir")).strip()
+            )
+        except FileNotFoundError:
+            common_dir = git_dir
+        if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+            raise Unsupported("Invalid git directory")
+        if os.path.isdir(os.path.join(common_dir, "reftable")):
+            raise Unsupported("The reftable format is not supported")
+        return cls(git_dir, os.path.normpath(common_dir))
+
+    def _get_config_files(self):
+        files = []
+        if "GIT_CONFIG_NOSYSTEM" not in os.environ:
+            files.append(SYSTEM_CONFIG)
+        home = os.environ.get("HOME")
+        if home is None:
+            raise Unsupported("HOME is not set")
+        xdg_config = os.environ.get("XDG_CONFIG_HOME") or os.path.join(home, ".config")
+        files.append(os.path.join(xdg_config, "git", "config"))
+        files.append(os.path.join(home, ".gitconfig"))
+        return files
+
+    @property
+    def config(self):
+        """The entries of all the configuration files, in git order."""
+        if self._config is None:
+            config = []
+            for path in self._get_config_files():
+                config.extend(_read_config(path))
+            local = list(_read_config(os.path.join(self.common_dir, "config")))
+            config.extend(local)
+            if _is_true(dict(local).get("extensions.worktreeconfig", "false")):
+                config.extend(
+                    _read_config(os.path.join(self.git_dir, "config.worktree"))
+                )
+            self._config = config
+        return self._config
+
+    def get_config_all(self, key):
+        key = normalize_key(key)
+        return [v for k, v in self.config if k == key]
+
+    def get_config(self, key):
+        """Return the value of `key` like `git config --get`, or None."""
+        values = self.get_config_all(key)
+        if not values:
+            return None
+        # Variables without value are shown as empty
+        return values[-1] or ""
+
+    @property
+    def packed_refs(self):
+        if self._packed_refs is None:
+            self._packed_refs = {}
+            try:
+                content = _read(os.path.join(self.common_dir, "packed-refs"))
+            except FileNotFoundError:
+                content = ""
+            for line in content.splitlines():
+                if line and line[0] not in "#^":
+                    sha, _, ref = line.partition(" ")
+                    self._packed_refs[ref] = sha
+        return self._packed_refs
+
+    def _read_ref(self, ref):
+        if ref.startswith("refs/") and not ref.startswith(_PER_WORKTREE_REFS):
+            path = os.path.join(self.common_dir, ref)
+        elif not ref.startswith("refs/") and not _PSEUDO_REF_RE.match(ref):
+            # e.g. "index" or "config", which are not references
+            return None
+        else:
+            path = os.path.join(self.git_dir, ref)
+        try:
+            return _read(path).strip()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return self.packed_refs.get(ref)
+
+    def resolve_ref(self, ref):
+        """Return the object `ref` points to, or None if it does not exist."""
+        for _ in range(_MAX_INCLUDE_DEPTH):
+            value = self._read_ref(ref)
+            if value is None:
+                return None
+            if not value.startswith("ref: "):
+                if not _SHA_RE.match(value):
+                    raise Unsupported("Invalid reference `%s'" % ref)
+                return value
+            ref = value[5:]
+        raise Unsupported("Too many symbolic references")
+
+    def get_head_branch(self):
+        """Return the current branch like `git rev-parse --abbrev-ref HEAD`.
+
+        "HEAD" is returned when the HEAD is detached.
+        """
+        head = _read(os.path.join(self.git_dir, "HEAD")).strip()
+        if not head.startswith("ref: "):
+            return "HEAD"
+        ref = head[5:]
+        if not ref.startswith("refs/heads/") or self.resolve_ref(ref) is None:
+            raise Unsupported("HEAD does not point to an existing branch")
+        branch = ref[11:]
+        # git shortens the name less when another reference has the same one
+        for other in (
+            branch,
+            "refs/" + branch,
+            "refs/tags/" + branch,
+            "refs/remotes/" + branch,
+            "refs/remotes/%s/HEAD" % branch,
+        ):
+            if self._read_ref(other) is not None:
+                raise Unsupported("Ambiguous branch name `%s'" % branch)
+        return branch
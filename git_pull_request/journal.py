@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import time
+
+from git_pull_request import lock
+
+
+def get_path(git_dir):
+    return os.path.join(git_dir, "git-pull-request", "journal")
+
+
+def record(git_dir, **entry):
+    """Append an operation to the journal."""
+    path = get_path(git_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry["time"] = time.time()
+    with lock.locked(git_dir, "journal"), open(path, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def load(git_dir):
+    try:
+        with open(get_path(git_dir)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def save(git_dir, entries):
+    """Replace the content of the journal with `entries`."""
+    path = get_path(git_dir)
+    if not entries:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return
+    lock.write_atomically(path, "".join(json.dumps(e) + "\n" for e in entries))
+
+
+def remove(git_dir, entries):
+    """Remove `entries` from the journal, keeping the ones queued meanwhile."""
+    with lock.locked(git_dir, "journal"):
+        save(git_dir, [e for e in load(git_dir) if e not in entries])
+
+
+def get_key(entry):
+    return entry["target_remote"], entry["target_branch"], entry["branch"]
+
+
+def collapse(entries):
+    """Merge the operations queued for the same pull request.
+
+    The latest title, message and options win, comments are merged into a
+    single one and labels are merged.
+
+    :return: A list of (entries, merged entry), in the journal order
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(get_key(entry), []).append(entry)
+
+    result = []
+    for group in groups.values():
+        merged = dict(group[-1])
+        merged["title"] = merged["message"] = None
+        comments = []
+        labels = []
+        for entry in group:
+            if entry.get("title") is not None:
+                merged["title"] = entry["title"]
+            if entry.get("message") is not None:
+                merged["message"] = entry["message"]
+            if entry.get("comment") and entry["comment"] not in comments:
+                comments.append(entry["comment"])
+            for label in entry.get("labels") or []:
+                if label not in labels:
+                    labels.append(label)
+        merged["comment"] = "\n\n".join(comments) or None
+        merged["labels"] = labels or None
+        result.append((group, merged))
+    return result
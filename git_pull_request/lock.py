@@ -0,0 +1,44 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import fcntl
+import os
+
+
+@contextlib.contextmanager
+def locked(git_dir, name):
+    """Hold an exclusive lock shared by the invocations using `git_dir`.
+
+    The lock is released when the process exits, even if it is killed.
+    """
+    path = os.path.join(git_dir, "git-pull-request", name + ".lock")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomically(path, content, mode=None):
+    """Replace the content of `path` without readers seeing a partial file.
+
+    :param mode: The permissions of the file, set before writing to it
+    """
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        if mode is not None:
+            os.fchmod(f.fileno(), mode)
+        f.write(content)
+    os.replace(tmp, path)
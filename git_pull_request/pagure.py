@@ -10,29 +10,47 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import functools
 
 import daiquiri
 import requests
 
+from git_pull_request import backend
+
 
 LOG = daiquiri.getLogger("git-pull-request")
 
+# How long a new fork may take to be created, in seconds
+FORK_TIMEOUT = 120
+
 
 def is_pagure(hostname):
-    return requests.get("https://%s/api/0/-/version" % hostname).ok
+    return backend.send("GET", "https://%s/api/0/-/version" % hostname).ok
+
 
+class Unauthorized(RuntimeError):
+    pass
 
-class Client:
+
+class Client(backend.Client):
     """Pagure interface loosely compatible with the github client."""
 
-    def __init__(self, hostname, user, password, reponame_to_fork):
-        """Client object hold all the necessary information."""
+    def __init__(self, hostname, user, password, reponame_to_fork, token_store=None):
+        """Client object hold all the necessary information.
+
+        :param token_store: Where to keep the project token between runs,
+                            with `get`, `save` and `reject` methods taking
+                            the fork path
+        """
         self.host = hostname
         self.user = user
         self.token = password
         self.reponame_to_fork = reponame_to_fork
         self.fork_path = "fork/%s/%s" % (self.user, self.reponame_to_fork)
         self.project_token = None
+        self.token_store = token_store
+        # Whether the fork has been requested and may not exist yet
+        self.fork_pending = False
         self.session = requests.session()
         # Do not use netrc because it forces a Basic authorization header
         self.session.trust_env = False
@@ -41,12 +59,16 @@ class Client:
         if token is None:
             token = self.token
         url = "https://%s/api/0/%s" % (self.host, endpoint)
-        resp = self.session.request(
-            method, url, data=data, headers=dict(Authorization="token %s" % token)
+        resp = backend.send(
+            method,
+            url,
+            self.session,
+            data=data,
+            headers=dict(Authorization="token %s" % token),
         )
         if not resp.ok:
             if resp.status_code == 401:
-                raise RuntimeError(resp.json().get("error"))
+                raise Unauthorized(resp.json().get("error"))
             if not error_ok:
                 raise RuntimeError(
                     "%s %s (%s) failed (%d) %s"
@@ -65,20 +87,28 @@ class Client:
     def get_project_tokens(self):
         return self.get("%s/connector" % self.fork_path)["connector"]["api_tokens"]
 
-    def get_project_token(self):
-        """Get or Create an API key for the project fork."""
-        if not self.project_token:
-            # Check if token already exists
-            tokens = list(
-                filter(
-                    lambda x: x["description"] == "git-pull-request"
-                    and not x["expired"],
-                    self.get_project_tokens(),
-                )
+    def get_project_token(self, use_store=True):
+        """Get or Create an API key for the project fork.
+
+        :param use_store: Whether the token kept in the token store may be
+                          used
+        """
+        if self.project_token:
+            return self.project_token
+        if use_store and self.token_store:
+            self.project_token = self.token_store.get(self.fork_path)
+            if self.project_token:
+                return self.project_token
+        # Check if token already exists
+        tokens = list(
+            filter(
+                lambda x: x["description"] == "git-pull-request" and not x["expired"],
+                self.get_project_tokens(),
             )
-            if tokens:
-                self.project_token = tokens[0]["id"]
-        if not self.project_token:
+        )
+        if tokens:
+            self.project_token = tokens[0]["id"]
+        else:
             # Otherwise, create the token
             resp = self.post(
                 "%s/token/new" % self.fork_path,
@@ -88,8 +118,22 @@ class Client:
                 ),
             )
             self.project_token = resp["token"]["id"]
+        if self.token_store:
+            self.token_store.save(self.fork_path, self.project_token)
         return self.project_token
 
+    def post_with_project_token(self, endpoint, data):
+        try:
+            return self.post(endpoint, data, self.get_project_token())
+        except Unauthorized:
+            if not self.token_store:
+                raise
+            # The stored token expired or has been revoked
+            LOG.debug("Project token of %s has been rejected", self.fork_path)
+            self.token_store.reject(self.fork_path, self.project_token)
+            self.project_token = None
+            return self.post(endpoint, data, self.get_project_token(use_store=False))
+
     def enable_pull_request(self, project):
         options = self.get("%s/options" % project)["settings"]
         if not options["pull_requests"]:
@@ -104,12 +148,8 @@ class Client:
         urls = self.get("{}/git/urls".format(reponame))["urls"]
         if "ssh" not in urls:
             raise RuntimeError("%s: ssh url is missing" % reponame)
-        return type(
-            "ForkedRepo",
-            (object,),
-            dict(
-                clone_url=urls["ssh"].format(username=self.user), html_url=urls["git"]
-            ),
+        return backend.Fork(
+            clone_url=urls["ssh"].format(username=self.user), html_url=urls["git"]
         )
 
     def create_fork(self, _):
@@ -122,43 +162,74 @@ class Client:
             namespace = None
             if repoinfo:
                 namespace = repoinfo.pop()
-            self.post("fork", {"repo": repo, "namespace": namespace, "wait": True})
+            # Do not have the server block until the fork is complete
+            self.post("fork", {"repo": repo, "namespace": namespace})
+            fork = self.get_new_fork_urls()
+            if fork is not None:
+                # Pushing waits for the fork, pull requests are enabled on
+                # it when the first one is created
+                self.fork_pending = True
+                return fork
+            self.wait_for_fork()
         self.enable_pull_request(self.fork_path)
         return self.get_repo_urls(self.fork_path)
 
-    def get_pulls(self, base, head):
-        class Pull:
-            edit = self.todo
-            host = self.host
-            repo = self.reponame_to_fork
-            body = ""
-
-            def __init__(self, number, title):
-                self.html_url = "https://%s/%s/pull-request/%d" % (
-                    self.host,
-                    self.repo,
-                    number,
-                )
-                self.number = number
-                self.title = title
+    def get_new_fork_urls(self):
+        """Return the URLs of a fork not created yet, or None if unknown.
+
+        They are derived from the URLs of the forked repository.
+        """
+        repo = self.get_repo_urls(self.reponame_to_fork)
+        suffix = "/%s.git" % self.reponame_to_fork
+        if not (repo.clone_url.endswith(suffix) and repo.html_url.endswith(suffix)):
+            return None
+        fork_suffix = "/forks/%s/%s.git" % (self.user, self.reponame_to_fork)
+        return backend.Fork(
+            clone_url=repo.clone_url[: -len(suffix)] + fork_suffix,
+            html_url=repo.html_url[: -len(suffix)] + fork_suffix,
+        )
 
-        # Pagure head doesn't contain the username
-        branch_from = head.split(":", 1)[1]
-        pulls = []
+    def wait_for_fork(self):
+        exists = functools.partial(self.get, self.fork_path, error_ok=True)
+        if not backend.poll(exists, FORK_TIMEOUT):
+            raise RuntimeError("Fork %s has not been created" % self.fork_path)
+
+    def _make_pull(self, pull):
+        return backend.PullRequest(
+            client=self,
+            number=pull["id"],
+            title=pull["title"],
+            body=pull.get("initial_comment") or "",
+            html_url="https://%s/%s/pull-request/%d"
+            % (self.host, self.reponame_to_fork, pull["id"]),
+            user=backend.User(pull["user"]["name"]),
+            head=backend.Ref(pull["branch_from"], backend.User(pull["user"]["name"])),
+            base=backend.Ref(pull["branch"], backend.User(self.user)),
+        )
+
+    def get_pulls(self, base):
         # TODO: support pagination
-        for pull in filter(
-            lambda x: (x["branch"] == base and x["branch_from"] == branch_from),
-            self.get("%s/pull-requests?author=%s" % (self.reponame_to_fork, self.user))[
-                "requests"
-            ],
-        ):
-            pulls.append(Pull(pull["id"], pull["title"]))
-        return pulls
+        return [
+            self._make_pull(pull)
+            for pull in self.get(
+                "%s/pull-requests?author=%s" % (self.reponame_to_fork, self.user)
+            )["requests"]
+            if pull["branch"] == base
+        ]
+
+    def get_pull(self, pull_number):
+        return self._make_pull(
+            self.get("%s/pull-request/%d" % (self.reponame_to_fork, pull_number))
+        )
 
     def create_pull(self, base, head, title, body):
+        if self.fork_pending:
+            self.wait_for_fork()
+            self.enable_pull_request(self.fork_path)
+            self.fork_pending = False
         # Pagure head doesn't contain the username
         branch_from = head.split(":", 1)[1]
-        resp = self.post(
+        resp = self.post_with_project_token(
             "%s/pull-request/new" % self.fork_path,
             dict(
                 title=title,
@@ -166,55 +237,5 @@ class Client:
                 branch_from=branch_from,
                 initial_comment=body,
             ),
-            self.get_project_token(),
         )
-
-        class Pull:
-            html_url = "https://%s/%s/pull-request/%d" % (
-                self.host,
-                self.reponame_to_fork,
-                resp["id"],
-            )
-
-        return Pull
-
-    # Shim layer to look like a github client
-    def get_user(self):
-        class User:
-            create_fork = self.create_fork
-
-        return User
-
-    def get_issue(self, x):
-        class Issue:
-            create_comment = self.todo
-
-        return Issue
-
-    def get_repo(self, reponame_to_fork):
-        class Repo:
-            class owner:
-                login = self.user
-
-            create_pull = self.create_pull
-            get_pulls = self.get_pulls
-            get_pull = self.get_pull
-            get_issue = self.get_issue
-
-        return Repo
-
-    def get_pull(self, pull_number):
-        class PullObject:
-            class user:
-                login = self.user
-
-            class head:
-                ref = "head"
-
-            number = pull_number
-
-        return PullObject
-
-    @staticmethod
-    def todo(*args, **kwargs):
-        LOG.warning("Updating title or adding comment is not implemented yet")
+        return self._make_pull(resp)
@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+
+from git_pull_request import lock
+
+
+def get_path(git_dir):
+    return os.path.join(git_dir, "git-pull-request", "pulls.json")
+
+
+def _load_all(git_dir):
+    try:
+        with open(get_path(git_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def load(git_dir, key):
+    """Return the pull request index of the repository `key`."""
+    return _load_all(git_dir).get(key, {"synced": None, "pulls": {}})
+
+
+def save(git_dir, key, index):
+    with lock.locked(git_dir, "pulls"):
+        data = _load_all(git_dir)
+        data[key] = index
+        lock.write_atomically(get_path(git_dir), json.dumps(data))
+
+
+def _make_entry(pull):
+    return {
+        "number": pull.number,
+        "title": pull.title,
+        "state": "merged" if pull.merged_at else pull.state,
+        "user": pull.user.login,
+        "head": pull.head.ref,
+        "base": pull.base.ref,
+        "sha": pull.head.sha,
+        "updated": pull.updated_at.isoformat(),
+    }
+
+
+def sync(repo, index):
+    """Update `index` with the pull requests updated since the last sync.
+
+    Pull requests are listed from the most recently updated one, and the
+    listing stops at the first one not updated since the last sync. The
+    first sync only fetches the open pull requests.
+
+    :return: The number of pull requests updated in the index
+    """
+    since = index["synced"]
+    pulls = repo.get_pulls(
+        state="open" if since is None else "all", sort="updated", direction="desc"
+    )
+    count = 0
+    for pull in pulls:
+        updated = pull.updated_at.isoformat()
+        if since is not None and updated < since:
+            break
+        index["pulls"][str(pull.number)] = _make_entry(pull)
+        if index["synced"] is None or updated > index["synced"]:
+            index["synced"] = updated
+        count += 1
+    return count
+
+
+def get_open(index):
+    """Return the open pull requests of `index`, most recent first."""
+    return sorted(
+        (pull for pull in index["pulls"].values() if pull["state"] == "open"),
+        key=lambda pull: pull["number"],
+        reverse=True,
+    )
@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Results of a run, reported as JSON lines with --json."""
+
+import contextlib
+import json
+import threading
+import time
+
+
+enabled = False
+_results = []
+_timings = {}
+_start = time.monotonic()
+_requests = 0
+_reported_requests = 0
+_lock = threading.Lock()
+
+
+def configure(enable):
+    """Start collecting the results of a new run."""
+    global enabled, _start, _requests, _reported_requests
+    enabled = enable
+    _results.clear()
+    _timings.clear()
+    _start = time.monotonic()
+    _requests = _reported_requests = 0
+
+
+def count_request():
+    global _requests
+    with _lock:
+        _requests += 1
+
+
+@contextlib.contextmanager
+def timed(phase):
+    """Add the time spent in the block to the timing of `phase`."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        _timings[phase] = round(_timings.get(phase, 0) + elapsed, 3)
+
+
+def _get_timings():
+    return dict(_timings, total=round(time.monotonic() - _start, 3))
+
+
+def add(action, count_requests=True, **fields):
+    """Record the result of a pull request.
+
+    :param action: What has been done, e.g. "created"
+    :param count_requests: Whether the forge requests have been counted,
+                           they are not for GitHub
+    """
+    global _reported_requests
+    if not enabled:
+        return
+    with _lock:
+        requests = _requests - _reported_requests
+        _reported_requests = _requests
+    result = dict(fields, action=action)
+    result["requests"] = requests if count_requests else None
+    result["timings"] = _get_timings()
+    _results.append(result)
+
+
+def get():
+    return list(_results)
+
+
+def dump(stream, retcode):
+    """Write a JSON object per result, or one describing the failure."""
+    results = get()
+    if retcode or not results:
+        results.append(
+            {"action": "failed" if retcode else "none", "exit_code": retcode or 0}
+        )
+        results[-1]["timings"] = _get_timings()
+    for result in results:
+        stream.write(json.dumps(result, sort_keys=True) + "\n")
+    stream.flush()
@@ -0,0 +1,297 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+import git_pull_request as gpr
+from git_pull_request import backend
+from git_pull_request import bitbucket
+from git_pull_request import pagure
+from git_pull_request import timeouts
+
+
+@pytest.fixture(autouse=True)
+def forget_responses():
+    backend.forget_responses()
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        return FakeResponse(self.responses[(method, url)])
+
+
+def _pagure_pull(number, branch, branch_from):
+    return {
+        "id": number,
+        "title": "PR %d" % number,
+        "initial_comment": "body",
+        "branch": branch,
+        "branch_from": branch_from,
+        "user": {"name": "jd"},
+    }
+
+
+def test_pagure_find_pulls():
+    client = pagure.Client("pagure.io", "jd", "token", "rpms/foo")
+    client.session = FakeSession(
+        {
+            (
+                "GET",
+                "https://pagure.io/api/0/rpms/foo/pull-requests?author=jd",
+            ): {
+                "requests": [
+                    _pagure_pull(1, "main", "feature"),
+                    _pagure_pull(2, "stable", "feature"),
+                    _pagure_pull(3, "main", "other"),
+                ]
+            }
+        }
+    )
+    repo = client.get_repo("rpms/foo")
+    pulls = gpr.find_pulls(repo, "main", "jd:feature")
+    assert [1] == [p.number for p in pulls]
+    assert "https://pagure.io/rpms/foo/pull-request/1" == pulls[0].html_url
+    assert "body" == pulls[0].body
+    assert not hasattr(pulls[0], "__dict__")
+
+
+def test_bitbucket_get_pull():
+    client = bitbucket.Client("bitbucket.org", "jd", "pass", "atlassian", "foo")
+    client.session = FakeSession(
+        {
+            (
+                "GET",
+                "https://api.bitbucket.org/2.0/repositories/atlassian/foo/"
+                "pullrequests/4",
+            ): {
+                "id": 4,
+                "title": "Fix",
+                "summary": {"raw": "Fix it"},
+                "source": {"branch": {"name": "fix"}},
+                "destination": {"branch": {"name": "master"}},
+            }
+        }
+    )
+    pull = client.get_repo("foo").get_pull(4)
+    assert ("Fix", "Fix it", "fix", "master") == (
+        pull.title,
+        pull.body,
+        pull.head.ref,
+        pull.base.ref,
+    )
+    assert "https://bitbucket.org/atlassian/foo/pull-requests/4" == pull.html_url
+    assert "jd" == client.get_user().login
+
+
+def test_send_timeouts():
+    session = FakeSession({("GET", "https://pagure.io/api/0/-/version"): {}})
+    session.kwargs = []
+    request = session.request
+
+    def recording_request(method, url, **kwargs):
+        session.kwargs.append(kwargs)
+        return request(method, url, **kwargs)
+
+    session.request = recording_request
+    backend.send("GET", "https://pagure.io/api/0/-/version", session)
+    assert [{"timeout": (10, 60)}] == session.kwargs
+
+    backend.forget_responses()
+    timeouts.configure(deadline=0)
+    try:
+        with pytest.raises(timeouts.DeadlineExceeded):
+            backend.send("GET", "https://pagure.io/api/0/-/version", session)
+    finally:
+        timeouts.configure()
+    assert 1 == len(session.requests)
+
+
+class FakeTokenStore:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def get(self, path):
+        return self.tokens.get(path)
+
+    def save(self, path, token):
+        self.tokens[path] = token
+
+    def reject(self, path, token):
+        del self.tokens[path]
+
+
+class TokenCheckingSession(FakeSession):
+    def request(self, method, url, headers=None, **kwargs):
+        if url.endswith("/new") and headers["Authorization"] != "token valid":
+            self.requests.append((method, url))
+            return FakeResponse({"error": "Invalid or expired token"}, 401)
+        return super().request(method, url, **kwargs)
+
+
+def test_pagure_project_token_store():
+    store = FakeTokenStore({"fork/jd/foo": "expired"})
+    client = pagure.Client("pagure.io", "jd", "token", "foo", store)
+    client.session = TokenCheckingSession(
+        {
+            (
+                "GET",
+                "https://pagure.io/api/0/fork/jd/foo/connector",
+            ): {
+                "connector": {
+                    "api_tokens": [
+                        {
+                            "id": "valid",
+                            "description": "git-pull-request",
+                            "expired": False,
+                        }
+                    ]
+                }
+            },
+            ("POST", "https://pagure.io/api/0/fork/jd/foo/pull-request/new"): (
+                _pagure_pull(1, "master", "feature")
+            ),
+        }
+    )
+    pull = client.get_repo("foo").create_pull("master", "jd:feature", "PR 1", "body")
+    assert 1 == pull.number
+    assert {"fork/jd/foo": "valid"} == store.tokens
+    assert [
+        ("POST", "https://pagure.io/api/0/fork/jd/foo/pull-request/new"),
+        ("GET", "https://pagure.io/api/0/fork/jd/foo/connector"),
+        ("POST", "https://pagure.io/api/0/fork/jd/foo/pull-request/new"),
+    ] == client.session.requests
+
+    # The stored token is used from now on
+    client = pagure.Client("pagure.io", "jd", "token", "foo", store)
+    assert "valid" == client.get_project_token()
+
+
+def test_poll(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("time.sleep", sleeps.append)
+    results = iter([False, False, False, "done"])
+    assert "done" == backend.poll(lambda: next(results), delay=1, max_delay=3)
+    assert [1, 2, 3] == sleeps
+
+    clock = iter(range(0, 100, 5))
+    monkeypatch.setattr("time.monotonic", lambda: next(clock))
+    assert not backend.poll(lambda: False, timeout=12)
+
+
+class ForkingSession(FakeSession):
+    """Create the fork after it has been requested and polled twice."""
+
+    def request(self, method, url, **kwargs):
+        if url == "https://pagure.io/api/0/fork/jd/foo":
+            self.requests.append((method, url))
+            polls = self.requests.count((method, url))
+            if ("POST", "https://pagure.io/api/0/fork") not in self.requests or (
+                polls < 3
+            ):
+                return FakeResponse({"error": "Not found"}, 404)
+            return FakeResponse({"name": "foo"})
+        return super().request(method, url, **kwargs)
+
+
+def test_pagure_create_fork(monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda delay: None)
+    client = pagure.Client("pagure.io", "jd", "token", "foo")
+    client.session = ForkingSession(
+        {
+            ("POST", "https://pagure.io/api/0/fork"): {},
+            ("GET", "https://pagure.io/api/0/foo/git/urls"): {
+                "urls": {
+                    "ssh": "ssh://{username}@pagure.io/foo.git",
+                    "git": "https://pagure.io/foo.git",
+                }
+            },
+            ("GET", "https://pagure.io/api/0/fork/jd/foo/options"): {
+                "settings": {"pull_requests": True}
+            },
+            ("GET", "https://pagure.io/api/0/fork/jd/foo/connector"): {
+                "connector": {
+                    "api_tokens": [
+                        {"id": "t", "description": "git-pull-request", "expired": False}
+                    ]
+                }
+            },
+            ("POST", "https://pagure.io/api/0/fork/jd/foo/pull-request/new"): {
+                "id": 1,
+                "title": "Title",
+                "branch": "master",
+                "branch_from": "feature",
+                "user": {"name": "jd"},
+            },
+        }
+    )
+    # The fork is not waited for
+    fork = client.create_fork(None)
+    assert "ssh://jd@pagure.io/forks/jd/foo.git" == fork.clone_url
+    assert "https://pagure.io/forks/jd/foo.git" == fork.html_url
+    assert [
+        ("GET", "https://pagure.io/api/0/fork/jd/foo"),
+        ("POST", "https://pagure.io/api/0/fork"),
+        ("GET", "https://pagure.io/api/0/foo/git/urls"),
+    ] == client.session.requests
+
+    # But it is before creating the first pull request
+    sent = len(client.session.requests)
+    client.create_pull("master", "jd:feature", "Title", "Body")
+    assert [
+        ("GET", "https://pagure.io/api/0/fork/jd/foo"),
+        ("GET", "https://pagure.io/api/0/fork/jd/foo"),
+        ("GET", "https://pagure.io/api/0/fork/jd/foo/options"),
+        ("GET", "https://pagure.io/api/0/fork/jd/foo/connector"),
+        ("POST", "https://pagure.io/api/0/fork/jd/foo/pull-request/new"),
+    ] == client.session.requests[sent:]
+    assert not client.fork_pending
+
+
+def test_send_reuses_get_responses():
+    client = pagure.Client("pagure.io", "jd", "token", "foo")
+    options = "https://pagure.io/api/0/fork/jd/foo/options"
+    client.session = FakeSession(
+        {
+            ("GET", options): {"settings": {"pull_requests": False}},
+            ("POST", options + "/update"): {},
+        }
+    )
+    client.enable_pull_request("fork/jd/foo")
+    client.get("fork/jd/foo/options")
+    # Another token may not see the same data
+    client.request("GET", "fork/jd/foo/options", token="other")
+    assert [
+        ("GET", options),
+        ("POST", options + "/update"),
+        ("GET", options),
+        ("GET", options),
+    ] == client.session.requests
+    client.get("fork/jd/foo/options")
+    assert 4 == len(client.session.requests)
@@ -0,0 +1,111 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import os
+import threading
+
+import fixtures
+
+import git_pull_request as gpr
+from git_pull_request import daemon
+
+
+class TestDaemon(fixtures.TestWithFixtures):
+    def setUp(self):
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        os.chdir(self.tempdir)
+        self.path = os.path.join(self.tempdir, "sock")
+        self.stdout = io.StringIO()
+        self.useFixture(fixtures.MonkeyPatch("sys.stdout", self.stdout))
+
+    def _serve(self, run):
+        server = daemon.Server(self.path, run)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+
+    def test_not_running(self):
+        self.assertIsNone(daemon.call([], None, self.path))
+
+    def test_call(self):
+        calls = []
+
+        def run(argv, connection):
+            calls.append((argv, os.getcwd()))
+            connection.send(log="hello")
+            self.assertEqual(
+                ("new title", "new body"),
+                connection.edit_title_and_message("title", "body"),
+            )
+            return 3
+
+        def edit(title, message):
+            return "new " + title, "new " + message
+
+        self._serve(run)
+        subdir = os.path.join(self.tempdir, "subdir")
+        os.mkdir(subdir)
+        os.chdir(subdir)
+        self.assertEqual(3, daemon.call(["-k"], edit, self.path))
+        self.assertEqual([(["-k"], subdir)], calls)
+        self.stdout.seek(0)
+        self.assertEqual("hello\n", self.stdout.read())
+
+    def test_success_is_not_fallback(self):
+        self._serve(lambda argv, connection: None)
+        self.assertEqual(0, daemon.call([], None, self.path))
+
+    def test_run_in_daemon_usage(self):
+        self._serve(gpr._run_in_daemon)
+        self.assertEqual(0, daemon.call(["--help"], None, self.path))
+        self.stdout.seek(0)
+        self.assertIn("--daemon", self.stdout.read())
+
+    def test_run_in_daemon_refuses_watch(self):
+        self._serve(gpr._run_in_daemon)
+        self.assertEqual(2, daemon.call(["-kw"], None, self.path))
+        self.stdout.seek(0)
+        self.assertIn("cannot be run by the daemon", self.stdout.read())
+
+    def test_main_runs_watch_locally(self):
+        runs = []
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                "git_pull_request.daemon.call",
+                lambda *args: self.fail("The daemon has been called"),
+            )
+        )
+        self.useFixture(fixtures.MonkeyPatch("daiquiri.setup", lambda **kw: None))
+        self.useFixture(fixtures.MonkeyPatch("git_pull_request.run", runs.append))
+        self.useFixture(fixtures.MonkeyPatch("sys.argv", ["git-pull-request", "-kw"]))
+        gpr.main()
+        self.assertTrue(runs[0].watch)
+
+    def test_run_in_daemon_forwards_child_output(self):
+        def run(args):
+            self.assertFalse(gpr.credential_prompt)
+            gpr._run_shell_command(["sh", "-c", "echo out; echo err >&2"])
+            list(gpr._stream_shell_command(["sh", "-c", "echo stream >&2"]))
+            return 0
+
+        self.useFixture(fixtures.MonkeyPatch("git_pull_request.run", run))
+        self._serve(gpr._run_in_daemon)
+        self.assertEqual(0, daemon.call([], None, self.path))
+        self.stdout.seek(0)
+        self.assertEqual("out\nerr\nstream\n", self.stdout.read())
+        self.assertIsNone(gpr.child_output)
+        self.assertTrue(gpr.credential_prompt)
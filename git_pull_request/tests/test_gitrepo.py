@@ -0,0 +1,156 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+import fixtures
+import pytest
+
+import git_pull_request as gpr
+from git_pull_request import gitrepo
+
+
+def test_parse_config():
+    assert [
+        ("core.bare", "false"),
+        ("core.implicit", None),
+        ('remote.My "Fork".url', "git@example.com:jd/gpr"),
+        ("remote.mirror.internal.pushurl", "a    b c"),
+        ("branch.main.merge", "refs/heads/main"),
+        ("section.key", 'quoted  "value" # kept\tand continued'),
+        ("old.style.key", "1"),
+        ("git-pull-request.hosttype", "pagure"),
+    ] == list(
+        gitrepo.parse_config(
+            "# comment\n"
+            "[core]\n"
+            "\tbare = false ; comment\n"
+            "\tImplicit\n"
+            '[remote "My \\"Fork\\""]\n'
+            "  URL=git@example.com:jd/gpr\n"
+            '[remote "mirror.internal"] pushurl = a  \t b c  \n'
+            '[Branch "main"]\n'
+            "merge = refs/heads/main\n"
+            "[section]\n"
+            'key = "quoted  \\"value\\" # kept\\t"and \\\n'
+            "continued\n"
+            "[Old.Style]\n"
+            "key = 1\n"
+            "[git-pull-request]\n"
+            "hosttype = pagure"
+        )
+    )
+
+
+def test_parse_config_invalid():
+    with pytest.raises(gitrepo.Unsupported):
+        list(gitrepo.parse_config('[core]\nkey = "unterminated\n'))
+    with pytest.raises(gitrepo.Unsupported):
+        list(gitrepo.parse_config("key = outside of a section\n"))
+
+
+def test_normalize_key():
+    assert "remote.Fork.pushurl" == gitrepo.normalize_key("Remote.Fork.pushURL")
+    assert "core.bare" == gitrepo.normalize_key("Core.Bare")
+
+
+class TestRepository(fixtures.TestWithFixtures):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.EnvironmentVariable("HOME", self.tempdir))
+        self.useFixture(fixtures.EnvironmentVariable("XDG_CONFIG_HOME"))
+        self.useFixture(fixtures.EnvironmentVariable("GIT_CONFIG_NOSYSTEM", "1"))
+        self.repo = os.path.join(self.tempdir, "repo")
+        gpr._run_shell_command(["git", "init", "-q", "-b", "main", self.repo])
+        os.chdir(self.repo)
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(["git", "commit", "--allow-empty", "-q", "-m", "Import"])
+
+    def _git_config(self, key):
+        return gpr._run_shell_command(
+            ["git", "config", "--get", key], output=True, raise_on_error=False
+        )
+
+    def test_config(self):
+        with open(os.path.join(self.tempdir, ".gitconfig"), "w") as f:
+            f.write('[remote "origin"]\n\turl = global\n[include]\npath = inc\n')
+        with open(os.path.join(self.tempdir, "inc"), "w") as f:
+            f.write("[git-pull-request]\nhosttype = pagure\n")
+        gpr._run_shell_command(["git", "remote", "add", "origin", "local"])
+        os.mkdir("sub")
+        repo = gitrepo.Repository.discover("sub")
+        for key in ("remote.origin.url", "git-pull-request.hosttype", "user.name"):
+            self.assertEqual(self._git_config(key), repo.get_config(key))
+        self.assertIsNone(repo.get_config("remote.missing.url"))
+        self.assertEqual(["global", "local"], repo.get_config_all("remote.origin.url"))
+
+    def test_conditional_include(self):
+        with open(os.path.join(self.tempdir, ".gitconfig"), "w") as f:
+            f.write('[includeIf "gitdir:~/"]\npath = inc\n')
+        repo = gitrepo.Repository.discover()
+        self.assertRaises(gitrepo.Unsupported, repo.get_config, "user.name")
+
+    def test_environment(self):
+        self.useFixture(fixtures.EnvironmentVariable("GIT_DIR", ".git"))
+        self.assertRaises(gitrepo.Unsupported, gitrepo.Repository.discover)
+
+    def test_head_branch(self):
+        self.assertEqual("main", gitrepo.Repository.discover().get_head_branch())
+        gpr._run_shell_command(["git", "pack-refs", "--all"])
+        self.assertEqual("main", gitrepo.Repository.discover().get_head_branch())
+        gpr._run_shell_command(["git", "checkout", "-q", "--detach"])
+        self.assertEqual("HEAD", gitrepo.Repository.discover().get_head_branch())
+
+    def test_head_branch_ambiguous(self):
+        gpr._run_shell_command(["git", "tag", "main"])
+        repo = gitrepo.Repository.discover()
+        self.assertRaises(gitrepo.Unsupported, repo.get_head_branch)
+        self.assertEqual("heads/main", gpr.git_get_branch_name())
+
+    def test_head_branch_named_like_git_dir_file(self):
+        for branch in ("index", "config", "description"):
+            gpr._run_shell_command(["git", "checkout", "-q", "-b", branch])
+            repo = gitrepo.Repository.discover()
+            self.assertEqual(branch, repo.get_head_branch())
+            self.assertEqual(branch, gpr.git_get_branch_name())
+
+    def test_head_branch_ambiguous_pseudo_ref(self):
+        gpr._run_shell_command(["git", "checkout", "-q", "-b", "ORIG_HEAD"])
+        gpr._run_shell_command(["git", "update-ref", "ORIG_HEAD", "HEAD"])
+        repo = gitrepo.Repository.discover()
+        self.assertRaises(gitrepo.Unsupported, repo.get_head_branch)
+        with open(os.path.join(".git", "ORIG_HEAD"), "wb") as f:
+            f.write(b"\xff\n")
+        self.assertRaises(gitrepo.Unsupported, repo.resolve_ref, "ORIG_HEAD")
+
+    def test_unborn_branch(self):
+        gpr._run_shell_command(["git", "checkout", "-q", "--orphan", "new"])
+        repo = gitrepo.Repository.discover()
+        self.assertRaises(gitrepo.Unsupported, repo.get_head_branch)
+
+    def test_worktree(self):
+        worktree = os.path.join(self.tempdir, "worktree")
+        gpr._run_shell_command(["git", "worktree", "add", "-q", "-b", "wt", worktree])
+        gpr._run_shell_command(["git", "config", "extensions.worktreeConfig", "true"])
+        gpr._run_shell_command(
+            ["git", "-C", worktree, "config", "--worktree", "branch.wt.remote", "up"]
+        )
+        repo = gitrepo.Repository.discover(worktree)
+        self.assertEqual(os.path.join(self.repo, ".git"), repo.common_dir)
+        self.assertEqual("wt", repo.get_head_branch())
+        self.assertEqual("up", repo.get_config("branch.wt.remote"))
+        self.assertIsNotNone(repo.resolve_ref("refs/heads/main"))
+        self.assertIsNone(gitrepo.Repository.discover().get_config("branch.wt.remote"))
@@ -12,7 +12,10 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from concurrent import futures
 import os
+import sys
+import types
 import unittest
 
 import attr
@@ -20,6 +23,8 @@ import fixtures
 import github
 
 import git_pull_request as gpr
+from git_pull_request import backend
+from git_pull_request import timeouts
 
 
 class TestRunShellCommand(unittest.TestCase):
@@ -36,6 +41,49 @@ class TestRunShellCommand(unittest.TestCase):
         )
         gpr._run_shell_command(["ls", "sureitdoesnoteixst"], raise_on_error=False)
 
+    def test_deadline(self):
+        self.addCleanup(timeouts.configure)
+        timeouts.configure(deadline=0.2)
+        with self.assertRaises(timeouts.DeadlineExceeded) as e:
+            gpr._run_shell_command(["sleep", "5"])
+        self.assertEqual(
+            "Deadline of 0.2s exceeded while running `sleep 5'", str(e.exception)
+        )
+        self.assertRaises(
+            timeouts.DeadlineExceeded, gpr._run_shell_command, ["echo", "arf"]
+        )
+
+    def test_stream(self):
+        self.assertEqual(
+            ["a", "b", "c"],
+            list(gpr._stream_shell_command(["printf", "a\\0b\\0c"], "\0")),
+        )
+
+    def test_stream_stop(self):
+        lines = gpr._stream_shell_command(["yes"])
+        self.assertEqual("y", next(lines))
+        lines.close()
+
+    def test_stream_error(self):
+        self.assertRaises(
+            RuntimeError, list, gpr._stream_shell_command(["ls", "sureitdoesnoteixst"])
+        )
+        self.assertEqual(
+            [],
+            list(
+                gpr._stream_shell_command(
+                    ["ls", "sureitdoesnoteixst"], raise_on_error=False
+                )
+            ),
+        )
+
+    def test_stream_large_records(self):
+        # Records larger than the pipe buffer are split across reads
+        records = gpr._stream_shell_command(
+            [sys.executable, "-c", "print('a' * 200000); print(); print('b')"]
+        )
+        self.assertEqual(["a" * 200000, "", "b"], list(records))
+
 
 class BaseTestGitRepo(fixtures.TestWithFixtures):
     def setUp(self):
@@ -124,6 +172,281 @@ class TestStuff(BaseTestGitRepo):
         )
 
 
+class TestGetClient(fixtures.TestWithFixtures):
+    def test_github_client_timeouts(self):
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                "github.Github.get_user",
+                lambda self, login: types.SimpleNamespace(get_repo=lambda name: name),
+            )
+        )
+        self.useFixture(fixtures.MonkeyPatch("git_pull_request._CLIENTS", {}))
+        self.addCleanup(timeouts.configure)
+        args = ("github", "github.com", "jd", "t", "jd", "gpr")
+
+        def get_timeout():
+            g, _ = gpr.get_client(*args)
+            return g, g.requester.kwargs["timeout"]
+
+        g, timeout = get_timeout()
+        self.assertEqual(10, timeout)
+        self.assertIs(g, get_timeout()[0])
+        timeouts.configure(connect=30, read=3)
+        self.assertEqual(3, get_timeout()[1])
+
+        # Timeouts bounded by a deadline are not reused by later runs
+        timeouts.configure(connect=3, deadline=30)
+        g, timeout = get_timeout()
+        self.assertEqual(3, timeout)
+        timeouts.configure(connect=3, deadline=0.5)
+        self.assertIsNot(g, get_timeout()[0])
+        self.assertEqual(1, get_timeout()[1])
+
+
+class TestGitIsAncestor(BaseTestGitRepo):
+    def test_is_ancestor(self):
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        for message in ("one", "two"):
+            gpr._run_shell_command(["git", "commit", "--allow-empty", "-qm", message])
+        self.assertTrue(gpr.git_is_ancestor("HEAD~", "HEAD"))
+        self.assertFalse(gpr.git_is_ancestor("HEAD", "HEAD~"))
+
+
+class TestGitPush(BaseTestGitRepo):
+    def test_push_to_mirrors(self):
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(["git", "commit", "--allow-empty", "-qm", "one"])
+        for name in ("fork", "mirror", "other"):
+            path = os.path.join(self.tempdir, name + ".git")
+            gpr._run_shell_command(["git", "init", "-q", "--bare", path])
+            gpr._run_shell_command(["git", "remote", "add", name, path])
+            gpr._run_shell_command(
+                ["git", "config", "--add", "git-pull-request.mirror-remote", name]
+            )
+        gpr._run_shell_command(["git", "remote", "add", "missing", "/nonexistent"])
+        self.assertEqual(
+            ["fork", "mirror", "other"],
+            gpr.git_get_config_all("git-pull-request.mirror-remote"),
+        )
+
+        head = gpr._run_shell_command(["git", "rev-parse", "HEAD"], output=True)
+        self.assertTrue(gpr.git_push("fork", ["HEAD:pr"], ["mirror", "other"]))
+        self.assertFalse(gpr.git_push("fork", ["HEAD:pr2"], ["missing", "mirror"]))
+        for remote, ref in (("fork", "pr"), ("other", "pr"), ("mirror", "pr2")):
+            self.assertEqual(
+                head,
+                gpr._run_shell_command(
+                    ["git", "ls-remote", remote, "refs/heads/" + ref], output=True
+                ).split()[0],
+            )
+        self.assertRaises(
+            RuntimeError, gpr.git_push, "missing", ["HEAD:pr"], ["mirror"]
+        )
+
+
+class TestGitRebaseInMemory(BaseTestGitRepo):
+    def setUp(self):
+        super().setUp()
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(["git", "checkout", "-q", "-b", "main"])
+        self.commit("base", "base")
+        gpr._run_shell_command(["git", "checkout", "-q", "-b", "feature"])
+        self.commit("feature", "one", author="Author <author@example.com>")
+        self.commit("feature", "two")
+        gpr._run_shell_command(["git", "checkout", "-q", "main"])
+        self.commit("upstream", "upstream")
+
+    @staticmethod
+    def commit(filename, content, author=None):
+        with open(filename, "w") as f:
+            f.write(content)
+        gpr._run_shell_command(["git", "add", filename])
+        cmd = ["git", "commit", "-q", "-m", "Write %s in %s" % (content, filename)]
+        if author:
+            cmd.append("--author=" + author)
+        gpr._run_shell_command(cmd)
+
+    @staticmethod
+    def log(revision):
+        return gpr._run_shell_command(
+            ["git", "log", "--format=%an %s", revision, "--"], output=True
+        ).split("\n")
+
+    def test_rebase(self):
+        self.assertTrue(gpr.git_rebase_in_memory("main", "feature"))
+        self.assertEqual(
+            [
+                "nobody Write two in feature",
+                "Author Write one in feature",
+                "nobody Write upstream in upstream",
+                "nobody Write base in base",
+            ],
+            self.log("feature"),
+        )
+        # The branch has not been checked out
+        self.assertEqual("main", gpr.git_get_branch_name())
+        self.assertFalse(os.path.exists("feature"))
+
+        # Rebasing again is a no-op
+        tip = gpr._run_shell_command(["git", "rev-parse", "feature"], output=True)
+        self.assertTrue(gpr.git_rebase_in_memory("main", "feature"))
+        self.assertEqual(
+            tip, gpr._run_shell_command(["git", "rev-parse", "feature"], output=True)
+        )
+
+    def test_rebase_checked_out_branch(self):
+        gpr._run_shell_command(["git", "checkout", "-q", "feature"])
+        self.assertTrue(gpr.git_rebase_in_memory("main", "feature"))
+        with open("upstream") as f:
+            self.assertEqual("upstream", f.read())
+        self.assertEqual(
+            "", gpr._run_shell_command(["git", "status", "--porcelain"], output=True)
+        )
+
+    def test_rebase_drops_applied_commits(self):
+        self.commit("feature", "one")
+        self.assertTrue(gpr.git_rebase_in_memory("main", "feature"))
+        self.assertEqual(
+            [
+                "nobody Write two in feature",
+                "nobody Write one in feature",
+                "nobody Write upstream in upstream",
+                "nobody Write base in base",
+            ],
+            self.log("feature"),
+        )
+
+    def test_rebase_conflict(self):
+        self.commit("feature", "conflict")
+        tip = gpr._run_shell_command(["git", "rev-parse", "feature"], output=True)
+        self.assertFalse(gpr.git_rebase_in_memory("main", "feature"))
+        self.assertEqual(
+            tip, gpr._run_shell_command(["git", "rev-parse", "feature"], output=True)
+        )
+
+
+class TestGitWaitForRepository(BaseTestGitRepo):
+    def test_wait_for_repository(self):
+        fork = os.path.join(self.tempdir, "fork.git")
+        gpr._run_shell_command(["git", "remote", "add", "fork", fork])
+        sleeps = []
+
+        def create_fork(delay):
+            sleeps.append(delay)
+            gpr._run_shell_command(["git", "init", "-q", "--bare", fork])
+
+        self.useFixture(fixtures.MonkeyPatch("time.sleep", create_fork))
+        self.assertTrue(gpr.git_wait_for_repository("fork"))
+        self.assertEqual(1, len(sleeps))
+
+
+class TestRemoteIndex(BaseTestGitRepo):
+    def test_repository_id_is_hashable(self):
+        self.assertEqual(
+            {gpr.RepositoryId("github", "github.com", "jd", "git-pull-request")},
+            {gpr.RepositoryId("github", "GitHub.com", "JD", "Git-Pull-Request")},
+        )
+        self.assertNotEqual(
+            gpr.RepositoryId("github", "github.com", "jd", "git-pull-request"),
+            gpr.RepositoryId("pagure", "github.com", "jd", "git-pull-request"),
+        )
+
+    def test_git_get_remote_index(self):
+        for name, url in (
+            ("origin", "https://github.com/jd/git-pull-request.git"),
+            ("mirror.internal", "git@example.com:jd/git-pull-request"),
+            ("local", "/tmp/not-a-forge"),
+            ("fork", "https://github.com/Flameeyes/git-pull-request"),
+        ):
+            gpr._run_shell_command(["git", "remote", "add", name, url])
+        gpr._run_shell_command(
+            [
+                "git",
+                "remote",
+                "set-url",
+                "--push",
+                "fork",
+                "git@github.com:Flameeyes/git-pull-request-push",
+            ]
+        )
+        self.assertEqual(
+            {
+                gpr.RepositoryId(
+                    "github", "github.com", "jd", "git-pull-request"
+                ): "origin",
+                gpr.RepositoryId(
+                    "github", "example.com", "jd", "git-pull-request"
+                ): "mirror.internal",
+                gpr.RepositoryId(
+                    "github", "github.com", "Flameeyes", "git-pull-request-push"
+                ): "fork",
+            },
+            gpr.git_get_remote_index(),
+        )
+        self.assertIsNone(
+            gpr.git_remote_matching_url("https://github.com/Flameeyes/git-pull-request")
+        )
+        self.assertEqual(
+            "fork",
+            gpr.git_remote_matching_url(
+                "https://github.com/flameeyes/Git-Pull-Request-Push.git"
+            ),
+        )
+
+    def test_git_get_remote_index_rewrites(self):
+        for key, value in (
+            ("url.https://github.com/.insteadOf", "gh:"),
+            ("url.https://example.com/jd/.insteadOf", "gh:jd/"),
+            ("url.git@github.com:.pushInsteadOf", "mirror:"),
+        ):
+            gpr._run_shell_command(["git", "config", "--add", key, value])
+        for name, url in (
+            ("fork", "gh:jd/git-pull-request"),
+            ("origin", "gh:Flameeyes/git-pull-request"),
+            ("mirror", "mirror:Flameeyes/gpr"),
+        ):
+            gpr._run_shell_command(["git", "remote", "add", name, url])
+        self.assertEqual(
+            {
+                gpr.RepositoryId(
+                    "github", "example.com", "jd", "git-pull-request"
+                ): "fork",
+                gpr.RepositoryId(
+                    "github", "github.com", "Flameeyes", "git-pull-request"
+                ): "origin",
+                gpr.RepositoryId("github", "github.com", "Flameeyes", "gpr"): "mirror",
+            },
+            gpr.git_get_remote_index(),
+        )
+        self.assertEqual(
+            "fork",
+            gpr.git_remote_matching_url("https://example.com/jd/git-pull-request.git"),
+        )
+
+    def test_git_add_remote_concurrently(self):
+        url = "https://github.com/jd/git-pull-request.git"
+        with futures.ThreadPoolExecutor(8) as executor:
+            remotes = list(
+                executor.map(lambda _: gpr.git_add_remote("github", url), range(8))
+            )
+        self.assertEqual(["github"] * 8, remotes)
+
+    def test_git_add_remote_detects_hosttype(self):
+        gpr._run_shell_command(
+            ["git", "config", "--unset", "git-pull-request.hosttype"]
+        )
+        for name in ("bitbucket.is_bitbucket", "pagure.is_pagure"):
+            self.useFixture(
+                fixtures.MonkeyPatch("git_pull_request." + name, lambda host: False)
+            )
+        url = "https://github.com/jd/git-pull-request.git"
+        self.assertEqual("github", gpr.git_add_remote("github", url))
+        self.assertEqual("github", gpr.git_get_config_hosttype())
+
+
 class TestGitCommand(fixtures.TestWithFixtures):
     def setUp(self):
         self.tempdir = self.useFixture(fixtures.TempDir()).path
@@ -213,6 +536,33 @@ class TestGitCommand(fixtures.TestWithFixtures):
         )
 
 
+class TestGitLog(BaseTestGitRepo):
+    def setUp(self):
+        super().setUp()
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        for i in range(10):
+            gpr._run_shell_command(
+                ["git", "commit", "--allow-empty", "-q", "-m", "Commit %d" % i]
+            )
+
+    def test_git_get_log(self):
+        log = gpr.git_get_log("HEAD~3", "HEAD")
+        self.assertEqual("## Commit 7\n\n\n## Commit 8\n\n\n## Commit 9", log)
+        self.assertEqual(log, gpr.git_get_log("HEAD~3", "HEAD", 100))
+
+    def test_git_get_log_truncated(self):
+        log = gpr.git_get_log("HEAD~9", "HEAD", 50)
+        self.assertLessEqual(len(log), 50)
+        self.assertEqual(
+            "## Commit 1\n\n\n## Commit 2\n\n\n... and 7 more commits", log
+        )
+        self.assertEqual(
+            "... and 9 more commits",
+            gpr.git_get_log("HEAD~9", "HEAD", 5),
+        )
+
+
 class TestGithubPRTemplate(fixtures.TestWithFixtures):
     def setUp(self):
         self.useFixture(fixtures.EnvironmentVariable("EDITOR", "cat"))
@@ -258,6 +608,7 @@ class TestGithubPRTemplate(fixtures.TestWithFixtures):
             os.path.join(self.tempdir, "PULL_REQUEST_TEMPLATE.md"), "w+"
         ) as pr_template:
             pr_template.write("# test")
+        gpr._run_shell_command(["git", "add", "PULL_REQUEST_TEMPLATE.md"])
 
         self.assertEqual(
             (
@@ -295,6 +646,39 @@ class TestGithubPRTemplate(fixtures.TestWithFixtures):
         assert gpr.parse_pr_message(message) == ("# test", "")
 
 
+class TestGetPullRequestTemplate(BaseTestGitRepo):
+    def _add_file(self, path, content):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        gpr._run_shell_command(["git", "add", path])
+
+    def test_no_template(self):
+        self.assertIsNone(gpr.get_pull_request_template())
+
+    def test_untracked_template(self):
+        with open("PULL_REQUEST_TEMPLATE.md", "w") as f:
+            f.write("# untracked")
+        self.assertIsNone(gpr.get_pull_request_template())
+
+    def test_priority_from_subdirectory(self):
+        self._add_file("docs/pull_request_template.md", "# docs")
+        self._add_file(".github/PULL_REQUEST_TEMPLATE/b.md", "# github b")
+        self._add_file(".github/pull_request_template/a.md", "# github a")
+        os.makedirs("sub/dir")
+        os.chdir("sub/dir")
+        self.assertEqual("# github b", gpr.get_pull_request_template())
+        os.chdir(self.tempdir)
+        self._add_file("PULL_REQUEST_TEMPLATE", "# root")
+        os.chdir("sub/dir")
+        self.assertEqual("# root", gpr.get_pull_request_template())
+
+    def test_exact_case_first(self):
+        self._add_file("pull_request_template.md", "# root")
+        self._add_file(".github/PULL_REQUEST_TEMPLATE.md", "# github")
+        self.assertEqual("# github", gpr.get_pull_request_template())
+
+
 class TestMessageParsing(fixtures.TestWithFixtures):
     def test_only_title(self):
         self.useFixture(fixtures.EnvironmentVariable("EDITOR", "cat"))
@@ -380,6 +764,94 @@ class TestExceptionFormatting(unittest.TestCase):
         )
 
 
+class FakeRequester:
+    is_lazy = True
+    is_not_lazy = False
+
+    def __init__(self):
+        self.requests = []
+
+    def requestJsonAndCheck(self, verb, url, input=None, **kwargs):
+        self.requests.append((verb, url, input))
+        return {}, {}
+
+
+class FakeForgeClient:
+    def __init__(self):
+        self.calls = []
+
+    def edit_pull(self, pull, title=None, body=None):
+        self.calls.append(("edit", title, body))
+
+    def create_comment(self, number, body):
+        self.calls.append(("comment", number, body))
+
+    def add_to_labels(self, pull, *labels):
+        self.calls.append(("labels",) + labels)
+
+
+class TestPullRequestUpdate(unittest.TestCase):
+    def _github_pull(self, requester):
+        return github.PullRequest.PullRequest(
+            requester,
+            {},
+            {
+                "number": 1,
+                "title": "title",
+                "body": "body",
+                "url": "https://api.github.com/repos/jd/foo/pulls/1",
+                "issue_url": "https://api.github.com/repos/jd/foo/issues/1",
+                "labels": [{"name": "bug"}],
+            },
+            completed=True,
+        )
+
+    def test_github(self):
+        requester = FakeRequester()
+        update = gpr.PullRequestUpdate(self._github_pull(requester))
+        update.set_title("new title")
+        update.set_body("body")
+        update.add_labels(["bug", "feature"])
+        update.add_comment("hello")
+        update.submit()
+        self.assertEqual(
+            [
+                (
+                    "PATCH",
+                    "https://api.github.com/repos/jd/foo/issues/1",
+                    {"title": "new title", "labels": ["bug", "feature"]},
+                ),
+                (
+                    "POST",
+                    "https://api.github.com/repos/jd/foo/issues/1/comments",
+                    {"body": "hello"},
+                ),
+            ],
+            requester.requests,
+        )
+
+    def test_github_up_to_date(self):
+        update = gpr.PullRequestUpdate(self._github_pull(FakeRequester()))
+        update.set_title("title")
+        update.set_body("body")
+        update.add_labels(["bug"])
+        update.add_comment(None)
+        self.assertFalse(update)
+
+    def test_backend(self):
+        client = FakeForgeClient()
+        pull = backend.PullRequest(client, 2, "title", "body", "url", None, None, None)
+        update = gpr.PullRequestUpdate(pull)
+        update.set_body("new body")
+        update.add_labels(["bug"])
+        update.add_comment("hello")
+        update.submit()
+        self.assertEqual(
+            [("edit", None, "new body"), ("labels", "bug"), ("comment", 2, "hello")],
+            client.calls,
+        )
+
+
 class TestGithubHostnameUserRepoFromUrl(BaseTestGitRepo):
     def test_git_clone_url(self):
         expected = gpr.RepositoryId("github", "example.com", "jd", "git-pull-request")
@@ -432,3 +904,291 @@ class TestGitConfig(fixtures.TestWithFixtures):
         self.assertEqual(True, args.setup_only)
         self.assertEqual("never", args.fork)
         self.assertEqual("awesome_branch", args.target_branch)
+
+
+class TestDownloadPullRequest(fixtures.TestWithFixtures):
+    def setUp(self):
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        upstream = os.path.join(self.tempdir, "upstream.git")
+        self.fork = os.path.join(self.tempdir, "fork.git")
+        gpr._run_shell_command(["git", "init", "--quiet", "--bare", upstream])
+        gpr._run_shell_command(["git", "init", "--quiet", "--bare", self.fork])
+        os.chdir(self.tempdir)
+        gpr._run_shell_command(["git", "init", "--quiet", "work"])
+        os.chdir(os.path.join(self.tempdir, "work"))
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(["git", "remote", "add", "origin", upstream])
+        gpr._run_shell_command(
+            ["git", "commit", "--allow-empty", "--no-edit", "-q", "-m", "Import"]
+        )
+        gpr._run_shell_command(["git", "push", "-q", "origin", "HEAD:master"])
+        gpr._run_shell_command(
+            ["git", "commit", "--allow-empty", "--no-edit", "-q", "-m", "Change"]
+        )
+        self.head = gpr._run_shell_command(["git", "rev-parse", "HEAD"], output=True)
+        gpr._run_shell_command(
+            ["git", "push", "-q", "origin", "HEAD:refs/pull/42/head"]
+        )
+        gpr._run_shell_command(["git", "push", "-q", self.fork, "HEAD:feature"])
+        gpr._run_shell_command(["git", "reset", "-q", "--hard", "HEAD^"])
+        gpr._run_shell_command(["git", "fetch", "-q", "origin"])
+
+        user = types.SimpleNamespace(login="contributor")
+        self.pull = types.SimpleNamespace(
+            number=42,
+            user=user,
+            head=types.SimpleNamespace(
+                ref="feature", repo=types.SimpleNamespace(clone_url=self.fork)
+            ),
+            base=types.SimpleNamespace(ref="master"),
+        )
+        self.repo = types.SimpleNamespace(get_pull=lambda number: self.pull)
+
+    def test_download(self):
+        gpr.download_pull_request(None, self.repo, "origin", 42, False)
+        self.assertEqual("pull/42-contributor-feature", gpr.git_get_branch_name())
+        self.assertEqual(
+            self.head, gpr._run_shell_command(["git", "rev-parse", "HEAD"], output=True)
+        )
+
+    def test_download_and_setup(self):
+        gpr.download_pull_request(None, self.repo, "origin", 42, True)
+        self.assertEqual("feature", gpr.git_get_branch_name())
+        self.assertEqual(
+            self.head, gpr._run_shell_command(["git", "rev-parse", "HEAD"], output=True)
+        )
+        self.assertEqual(
+            "refs/remotes/github-contributor/feature",
+            gpr._run_shell_command(
+                [
+                    "git",
+                    "for-each-ref",
+                    "--format=%(refname)",
+                    "refs/remotes/github-contributor/",
+                ],
+                output=True,
+            ),
+        )
+        self.assertEqual("origin", gpr.git_get_remote_for_branch("feature"))
+
+    def test_download_and_setup_in_worktree(self):
+        worktree_dir = os.path.join(self.tempdir, "pulls")
+        path = os.path.join(worktree_dir, "42")
+        for _ in range(2):
+            gpr.download_pull_request(
+                None, self.repo, "origin", 42, True, True, worktree_dir, True
+            )
+            self.assertEqual(
+                "feature",
+                gpr._run_shell_command(
+                    ["git", "-C", path, "symbolic-ref", "--short", "HEAD"],
+                    output=True,
+                ),
+            )
+            self.assertEqual(
+                self.head,
+                gpr._run_shell_command(
+                    ["git", "-C", path, "rev-parse", "HEAD"], output=True
+                ),
+            )
+        self.assertEqual("origin", gpr.git_get_remote_for_branch("feature"))
+        self.assertEqual("master", gpr.git_get_branch_name())
+
+    def test_download_several(self):
+        gpr._run_shell_command(
+            ["git", "push", "-q", "origin", "master:refs/pull/43/head"]
+        )
+        pulls = {
+            42: self.pull,
+            43: types.SimpleNamespace(
+                number=43,
+                user=self.pull.user,
+                head=types.SimpleNamespace(ref="other"),
+            ),
+        }
+        repo = types.SimpleNamespace(get_pull=pulls.get)
+        worktree_dir = os.path.join(self.tempdir, "pulls")
+
+        for _ in range(2):
+            gpr.download_pull_requests(None, repo, "origin", [42, 43], worktree_dir)
+            self.assertEqual(
+                self.head,
+                gpr._run_shell_command(
+                    [
+                        "git",
+                        "-C",
+                        os.path.join(worktree_dir, "42"),
+                        "rev-parse",
+                        "HEAD",
+                    ],
+                    output=True,
+                ),
+            )
+            self.assertEqual(
+                "pull/43-contributor-other",
+                gpr._run_shell_command(
+                    [
+                        "git",
+                        "-C",
+                        os.path.join(worktree_dir, "43"),
+                        "rev-parse",
+                        "--abbrev-ref",
+                        "HEAD",
+                    ],
+                    output=True,
+                ),
+            )
+        self.assertEqual("master", gpr.git_get_branch_name())
+
+    def test_download_sparse(self):
+        for path in ("README", "docs/index", "src/module/code"):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w") as f:
+                f.write(path)
+        gpr._run_shell_command(["git", "add", "README", "docs"])
+        gpr._run_shell_command(["git", "commit", "-q", "-m", "Docs"])
+        gpr._run_shell_command(["git", "push", "-q", "origin", "HEAD:master"])
+        gpr._run_shell_command(["git", "add", "src"])
+        gpr._run_shell_command(["git", "commit", "-q", "-m", "Code"])
+        gpr._run_shell_command(
+            ["git", "push", "-q", "--force", "origin", "HEAD:refs/pull/42/head"]
+        )
+        worktree_dir = os.path.join(self.tempdir, "pulls")
+        path = os.path.join(worktree_dir, "42")
+
+        for _ in range(2):
+            gpr.download_pull_requests(
+                None, self.repo, "origin", [42], worktree_dir, True
+            )
+            self.assertEqual([".git", "README", "src"], sorted(os.listdir(path)))
+            self.assertTrue(os.path.exists(os.path.join(path, "src/module/code")))
+        self.assertEqual("master", gpr.git_get_branch_name())
+
+    def test_parse_several_downloads(self):
+        args = gpr.build_parser().parse_args(["--download", "1", "2"])
+        self.assertEqual([1, 2], args.download)
+        self.assertFalse(args.download_setup)
+        args = gpr.build_parser().parse_args(["-D", "3"])
+        self.assertEqual([3], args.download)
+        self.assertTrue(args.download_setup)
+
+
+class FakePullRequestRepo:
+    """Fake forge repository recording created pull requests."""
+
+    def __init__(self, login="jd"):
+        self.owner = types.SimpleNamespace(login=login)
+        self.pulls = []
+
+    def get_pulls(self, base):
+        return [p for p in self.pulls if p.base.ref == base]
+
+    def create_pull(self, base, head, title, body):
+        owner, _, ref = head.partition(":")
+        pull = types.SimpleNamespace(
+            number=len(self.pulls) + 1,
+            title=title,
+            body=body,
+            html_url="https://example.com/pull/%d" % (len(self.pulls) + 1),
+            base=types.SimpleNamespace(ref=base),
+            head=types.SimpleNamespace(
+                ref=ref, user=types.SimpleNamespace(login=owner)
+            ),
+        )
+        self.pulls.append(pull)
+        return pull
+
+
+class TestStack(fixtures.TestWithFixtures):
+    def setUp(self):
+        self.useFixture(fixtures.EnvironmentVariable("EDITOR", "cat"))
+        self.useFixture(fixtures.EnvironmentVariable("GIT_EDITOR"))
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.upstream = os.path.join(self.tempdir, "upstream.git")
+        gpr._run_shell_command(["git", "init", "--quiet", "--bare", self.upstream])
+        os.chdir(self.tempdir)
+        gpr._run_shell_command(["git", "init", "--quiet", "work"])
+        os.chdir(os.path.join(self.tempdir, "work"))
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(["git", "remote", "add", "origin", self.upstream])
+        gpr._run_shell_command(
+            ["git", "commit", "--allow-empty", "--no-edit", "-q", "-m", "Import"]
+        )
+        gpr._run_shell_command(["git", "push", "-q", "origin", "HEAD:master"])
+        gpr._run_shell_command(["git", "fetch", "-q", "origin"])
+        gpr._run_shell_command(["git", "branch", "-q", "-u", "origin/master"])
+        parent = "master"
+        for name in ("A", "B", "C"):
+            gpr._run_shell_command(
+                ["git", "checkout", "-q", "--track", "-b", name, parent]
+            )
+            gpr._run_shell_command(
+                ["git", "commit", "--allow-empty", "--no-edit", "-q", "-m", name]
+            )
+            parent = name
+
+    def test_git_get_stack(self):
+        self.assertEqual(["A", "B", "C"], gpr.git_get_stack("C"))
+        self.assertEqual(["A"], gpr.git_get_stack("A"))
+
+    def test_push_stack(self):
+        # Move the target branch forward to require a rebase of the stack
+        upstream = gpr._run_shell_command(
+            ["git", "commit-tree", "-p", "master", "-m", "Upstream", "master^{tree}"],
+            output=True,
+        )
+        gpr._run_shell_command(["git", "push", "-q", "origin", upstream + ":master"])
+
+        repo = FakePullRequestRepo()
+        g = types.SimpleNamespace(get_user=lambda: types.SimpleNamespace(login="jd"))
+        retcode = gpr.fork_and_push_pull_request(
+            g,
+            "github",
+            repo,
+            True,
+            "origin",
+            "master",
+            "C",
+            "jd",
+            None,
+            None,
+            False,
+            None,
+            "never",
+            False,
+            None,
+            stack=["A", "B"],
+        )
+        self.assertIsNone(retcode)
+        self.assertEqual(
+            [("master", "jd/A", "A"), ("jd/A", "jd/B", "B"), ("jd/B", "jd/C", "C")],
+            [(p.base.ref, p.head.ref, p.title) for p in repo.pulls],
+        )
+        self.assertEqual(
+            "C\nB\nA",
+            gpr._run_shell_command(
+                [
+                    "git",
+                    "--git-dir",
+                    self.upstream,
+                    "log",
+                    "--format=%s",
+                    "master..jd/C",
+                ],
+                output=True,
+            ),
+        )
+        # The stack has been rebased on the new target branch
+        gpr._run_shell_command(
+            [
+                "git",
+                "--git-dir",
+                self.upstream,
+                "merge-base",
+                "--is-ancestor",
+                upstream,
+                "jd/A",
+            ]
+        )
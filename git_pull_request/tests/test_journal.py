@@ -0,0 +1,102 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+import fixtures
+
+import git_pull_request as gpr
+from git_pull_request import journal
+
+
+def _entry(branch, **kwargs):
+    entry = dict(
+        target_remote="origin",
+        target_branch="master",
+        branch=branch,
+        title=None,
+        message=None,
+        comment=None,
+        labels=None,
+    )
+    entry.update(kwargs)
+    return entry
+
+
+def test_collapse():
+    entries = [
+        _entry("a", title="First", message="Body", comment="hi", labels=["x"]),
+        _entry("b", comment="other"),
+        _entry("a", title="Second", comment="hi", labels=["y", "x"]),
+        _entry("a", comment="again"),
+    ]
+    collapsed = journal.collapse(entries)
+    assert ["a", "b"] == [merged["branch"] for _, merged in collapsed]
+    group, merged = collapsed[0]
+    assert [entries[0], entries[2], entries[3]] == group
+    assert "Second" == merged["title"]
+    assert "Body" == merged["message"]
+    assert "hi\n\nagain" == merged["comment"]
+    assert ["x", "y"] == merged["labels"]
+    assert collapsed[1][1]["labels"] is None
+
+
+class TestOffline(fixtures.TestWithFixtures):
+    def setUp(self):
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        os.chdir(self.tempdir)
+        gpr._run_shell_command(["git", "init", "--quiet", "-b", "feature"])
+        gpr._run_shell_command(
+            ["git", "remote", "add", "origin", "https://github.com/jd/gpr.git"]
+        )
+        gpr._run_shell_command(["git", "config", "branch.master.remote", "origin"])
+        gpr._run_shell_command(["git", "config", "user.name", "nobody"])
+        gpr._run_shell_command(["git", "config", "user.email", "nobody@example.com"])
+        gpr._run_shell_command(
+            ["git", "commit", "--allow-empty", "--no-edit", "-q", "-m", "Import"]
+        )
+
+    def test_queue(self):
+        for comment in ("one", "two"):
+            self.assertIsNone(
+                gpr.git_pull_request(
+                    title="Title",
+                    message="Message",
+                    comment=comment,
+                    offline=True,
+                )
+            )
+        entries = journal.load(os.path.join(self.tempdir, ".git"))
+        self.assertEqual(2, len(entries))
+        self.assertEqual(
+            ("origin", "master", "feature", "Title", "Message", "two"),
+            (
+                entries[1]["target_remote"],
+                entries[1]["target_branch"],
+                entries[1]["branch"],
+                entries[1]["title"],
+                entries[1]["message"],
+                entries[1]["comment"],
+            ),
+        )
+        journal.save(os.path.join(self.tempdir, ".git"), [])
+        self.assertEqual([], journal.load(os.path.join(self.tempdir, ".git")))
+
+    def test_remove_keeps_new_entries(self):
+        git_dir = os.path.join(self.tempdir, ".git")
+        journal.record(git_dir, **_entry("a"))
+        sent = journal.load(git_dir)
+        journal.record(git_dir, **_entry("b"))
+        journal.remove(git_dir, sent)
+        self.assertEqual(["b"], [e["branch"] for e in journal.load(git_dir)])
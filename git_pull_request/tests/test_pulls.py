@@ -0,0 +1,77 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import datetime
+import types
+
+import fixtures
+
+from git_pull_request import pulls
+
+
+def _pull(number, day, state="open"):
+    return types.SimpleNamespace(
+        number=number,
+        title="PR %d" % number,
+        state=state,
+        merged_at=None,
+        user=types.SimpleNamespace(login="jd"),
+        head=types.SimpleNamespace(ref="branch%d" % number, sha="%040d" % number),
+        base=types.SimpleNamespace(ref="master"),
+        updated_at=datetime.datetime(2020, 1, day, tzinfo=datetime.timezone.utc),
+    )
+
+
+class FakeRepo:
+    def __init__(self, pulls):
+        self.pulls = pulls
+        self.listed = []
+        self.requests = []
+
+    def get_pulls(self, state, sort, direction):
+        self.requests.append(state)
+        for pull in sorted(self.pulls, key=lambda p: p.updated_at, reverse=True):
+            if state == "all" or pull.state == state:
+                self.listed.append(pull.number)
+                yield pull
+
+
+def test_sync():
+    repo = FakeRepo([_pull(1, 1), _pull(2, 3), _pull(3, 2, state="closed")])
+    index = {"synced": None, "pulls": {}}
+    assert 2 == pulls.sync(repo, index)
+    assert ["open"] == repo.requests
+    assert ["2", "1"] == sorted(index["pulls"], reverse=True)
+
+    repo.pulls[0] = _pull(1, 4, state="closed")
+    repo.pulls.append(_pull(4, 5))
+    repo.listed = []
+    assert 3 == pulls.sync(repo, index)
+    # The listing stops at the first pull request not updated since
+    assert [4, 1, 2, 3] == repo.listed
+    assert "closed" == index["pulls"]["1"]["state"]
+    assert [4, 2] == [p["number"] for p in pulls.get_open(index)]
+
+
+def test_save_load():
+    git_dir = fixtures.TempDir()
+    git_dir.setUp()
+    try:
+        assert {"synced": None, "pulls": {}} == pulls.load(git_dir.path, "a")
+        pulls.save(git_dir.path, "a", {"synced": "x", "pulls": {}})
+        pulls.save(git_dir.path, "b", {"synced": "y", "pulls": {}})
+        assert "x" == pulls.load(git_dir.path, "a")["synced"]
+        assert "y" == pulls.load(git_dir.path, "b")["synced"]
+    finally:
+        git_dir.cleanUp()
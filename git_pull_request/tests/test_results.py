@@ -0,0 +1,51 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import json
+
+from git_pull_request import results
+
+
+def _dump(retcode):
+    output = io.StringIO()
+    results.dump(output, retcode)
+    return [json.loads(line) for line in output.getvalue().splitlines()]
+
+
+def test_dump():
+    results.configure(True)
+    try:
+        results.count_request()
+        with results.timed("push"):
+            pass
+        results.add("created", number=1)
+        results.add("updated", count_requests=False, number=2)
+
+        created, updated = _dump(0)
+        assert {"action": "created", "number": 1, "requests": 1} == {
+            k: v for k, v in created.items() if k != "timings"
+        }
+        assert {"push", "total"} == set(created["timings"])
+        assert updated["requests"] is None
+
+        failed = _dump(37)[-1]
+        assert ("failed", 37) == (failed["action"], failed["exit_code"])
+    finally:
+        results.configure(False)
+
+    results.add("created", number=1)
+    assert [{"action": "none", "exit_code": 0}] == [
+        {k: v for k, v in result.items() if k != "timings"} for result in _dump(0)
+    ]
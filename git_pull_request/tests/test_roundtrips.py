@@ -0,0 +1,294 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Guard the number of processes spawned and requests sent per scenario.
+
+The scenarios run against local bare repositories and a fake Pagure
+server. When a change needs more round trips, update the bounds.
+"""
+
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import fixtures
+import requests
+
+import git_pull_request as gpr
+from git_pull_request import journal
+from git_pull_request import results
+
+
+HOST = "pagure.example"
+API = "https://%s/api/0/" % HOST
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakePagure:
+    """A Pagure server knowing a single repository."""
+
+    def __init__(self, repo, user):
+        self.repo = repo
+        self.user = user
+        self.pulls = []
+        self.requests = []
+
+    def _pull(self, number, title, branch, branch_from, body):
+        return {
+            "id": number,
+            "title": title,
+            "initial_comment": body,
+            "branch": branch,
+            "branch_from": branch_from,
+            "user": {"name": self.user},
+        }
+
+    def request(self, method, url, data=None, **kwargs):
+        self.requests.append((method, url))
+        endpoint = url[len(API) :]
+        fork_path = "fork/%s/%s" % (self.user, self.repo)
+        if (method, endpoint) == (
+            "GET",
+            "%s/pull-requests?author=%s" % (self.repo, self.user),
+        ):
+            return FakeResponse({"requests": self.pulls})
+        if (method, endpoint) == ("GET", fork_path + "/connector"):
+            token = {"id": "ptoken", "description": "git-pull-request"}
+            token["expired"] = False
+            return FakeResponse({"connector": {"api_tokens": [token]}})
+        if (method, endpoint) == ("POST", fork_path + "/pull-request/new"):
+            pull = self._pull(
+                len(self.pulls) + 1,
+                data["title"],
+                data["branch_to"],
+                data["branch_from"],
+                data["initial_comment"],
+            )
+            self.pulls.append(pull)
+            return FakeResponse(pull)
+        if method == "GET" and endpoint.startswith(self.repo + "/pull-request/"):
+            return FakeResponse(self.pulls[int(endpoint.rsplit("/", 1)[1]) - 1])
+        return FakeResponse({"error": "Not found"}, 404)
+
+
+class TestRoundtrips(fixtures.TestWithFixtures):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.EnvironmentVariable("EDITOR", "true"))
+        self.useFixture(fixtures.EnvironmentVariable("GIT_EDITOR", "true"))
+
+        upstream = os.path.join(self.tempdir, "upstream.git")
+        self.git("init", "-q", "--bare", "-b", "master", upstream)
+        self.repo = os.path.join(self.tempdir, "repo")
+        self.git("init", "-q", "-b", "master", self.repo)
+        os.chdir(self.repo)
+        for key, value in (
+            ("user.name", "nobody"),
+            ("user.email", "nobody@example.com"),
+            ("url.%s/.insteadOf" % self.tempdir, "https://%s/" % HOST),
+            ("credential.helper", "!f() { echo username=jd; echo password=t; }; f"),
+            ("git-pull-request.hosttype", "pagure"),
+        ):
+            self.git("config", key, value)
+        self.git("remote", "add", "origin", "https://%s/upstream.git" % HOST)
+        self.commit("Import")
+        self.git("push", "-q", "-u", "origin", "master")
+        self.git("fetch", "-q", "origin")
+        self.git("checkout", "-q", "-b", "feature", "--track", "origin/master")
+        self.commit("Add feature")
+
+        self.forge = FakePagure("upstream", "jd")
+        self.useFixture(fixtures.MonkeyPatch("requests.session", lambda: self.forge))
+
+    @staticmethod
+    def git(*args):
+        subprocess.check_call(("git",) + args)
+
+    @staticmethod
+    def log_title(revision):
+        return subprocess.check_output(
+            ["git", "log", "-1", "--format=%s", revision], text=True
+        ).strip()
+
+    def commit(self, message):
+        self.git("commit", "--allow-empty", "-q", "-m", message)
+
+    def count(self, **kwargs):
+        """Run git-pull-request and return the commands and requests run."""
+        spawned = []
+        popen = subprocess.Popen
+
+        def counting_popen(cmd, *args, **kw):
+            spawned.append(cmd)
+            return popen(cmd, *args, **kw)
+
+        self.forge.requests = []
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(
+                fixtures.MonkeyPatch("subprocess.Popen", counting_popen)
+            )
+            # Each run starts cold, as from the command line
+            for name in ("_CLIENTS", "_CREDENTIALS", "backend._responses"):
+                stack.enter_context(
+                    fixtures.MonkeyPatch("git_pull_request." + name, {})
+                )
+            kwargs.setdefault("fork", "never")
+            self.assertFalse(gpr.git_pull_request(**kwargs))
+        return spawned, self.forge.requests
+
+    def assertRoundtrips(self, spawns, requests, counts):
+        spawned, sent = counts
+        self.assertLessEqual(
+            len(spawned), spawns, "Too many processes spawned: %s" % spawned
+        )
+        self.assertLessEqual(len(sent), requests, "Too many requests sent: %s" % sent)
+
+    def test_new_pull_request(self):
+        counts = self.count(title="Title", message="Message")
+        self.assertEqual(1, len(self.forge.pulls))
+        self.assertRoundtrips(10, 3, counts)
+
+    def test_project_token_kept(self):
+        self.count(title="Title", message="Message")
+        self.git("checkout", "-q", "-b", "other", "--track", "origin/master")
+        self.commit("Add other feature")
+        _, sent = self.count(title="Other", message="Message")
+        self.assertEqual(2, len(self.forge.pulls))
+        self.assertNotIn("GET", [method for method, url in sent[1:]])
+
+    def test_template_without_editor(self):
+        with open("PULL_REQUEST_TEMPLATE.md", "w") as f:
+            f.write("Fill me\n")
+        self.git("add", "PULL_REQUEST_TEMPLATE.md")
+        self.commit("Add template")
+        self.count(title="Title", edit_message=False)
+        self.assertEqual("Fill me\n", self.forge.pulls[0]["initial_comment"])
+
+    def test_queue_on_error(self):
+        request = self.forge.request
+
+        def unreachable(method, url, **kwargs):
+            if method == "POST":
+                raise requests.exceptions.ConnectionError()
+            return request(method, url, **kwargs)
+
+        self.useFixture(
+            fixtures.MonkeyPatch(
+                "git_pull_request.editor_hook", lambda title, message: ("T", "M")
+            )
+        )
+        self.forge.request = unreachable
+        self.assertRaises(
+            requests.exceptions.ConnectionError, gpr.git_pull_request, fork="never"
+        )
+        self.assertEqual(45, gpr.git_pull_request(fork="never", queue_on_error=True))
+        (entry,) = journal.load(os.path.join(self.repo, ".git"))
+        self.assertEqual(("T", "M"), (entry["title"], entry["message"]))
+
+        self.assertEqual(45, gpr.flush_pull_requests())
+        self.assertEqual(1, len(journal.load(os.path.join(self.repo, ".git"))))
+        self.forge.request = request
+        self.assertFalse(gpr.flush_pull_requests())
+        self.assertEqual("T", self.forge.pulls[0]["title"])
+        self.assertEqual("M", self.forge.pulls[0]["initial_comment"])
+
+    def test_update_pull_request(self):
+        self.count(title="Title", message="Message")
+        self.commit("Improve feature")
+        counts = self.count(keep_message=True)
+        self.assertEqual(1, len(self.forge.pulls))
+        self.assertRoundtrips(9, 1, counts)
+
+    def test_results(self):
+        results.configure(True)
+        self.addCleanup(results.configure, False)
+        self.count(title="Title", message="Message")
+        self.count(keep_message=True, rebase=False)
+        head = subprocess.check_output(["git", "rev-parse", "feature"], text=True)
+        created, up_to_date = results.get()
+        self.assertEqual(
+            {
+                "action": "created",
+                "branch": "feature",
+                "head": head.strip(),
+                "number": 1,
+                "requests": 3,
+                "url": "https://%s/upstream/pull-request/1" % HOST,
+            },
+            {k: v for k, v in created.items() if k != "timings"},
+        )
+        self.assertIn("rebase", created["timings"])
+        self.assertIn("push", created["timings"])
+        self.assertEqual("up-to-date", up_to_date["action"])
+        self.assertEqual(1, up_to_date["requests"])
+
+    def test_json_stdout(self):
+        self.useFixture(fixtures.MonkeyPatch("git_pull_request._CLIENTS", {}))
+        self.useFixture(fixtures.MonkeyPatch("git_pull_request._CREDENTIALS", {}))
+        args = gpr.build_parser().parse_args(
+            ["--json", "--fork", "never", "--title", "Title", "-m", "Message"]
+        )
+        # Commands write on the file descriptor, not through sys.stdout
+        with tempfile.TemporaryFile(mode="w+") as stdout:
+            saved = os.dup(1)
+            sys.stdout.flush()
+            os.dup2(stdout.fileno(), 1)
+            try:
+                with fixtures.MonkeyPatch("sys.stdout", stdout):
+                    self.assertFalse(gpr.run(args))
+            finally:
+                os.dup2(saved, 1)
+                os.close(saved)
+            stdout.seek(0)
+            lines = stdout.read().splitlines()
+        self.assertIsNone(gpr.child_output)
+        self.assertEqual(["created"], [json.loads(line)["action"] for line in lines])
+
+    def test_update_pull_request_in_memory(self):
+        self.count(title="Title", message="Message")
+        self.commit("Improve feature")
+        counts = self.count(keep_message=True, rebase_in_memory=True)
+        self.assertEqual(1, len(self.forge.pulls))
+        self.assertRoundtrips(11, 1, counts)
+
+    def test_up_to_date(self):
+        self.count(title="Title", message="Message")
+        counts = self.count(keep_message=True, rebase=False)
+        self.assertRoundtrips(6, 1, counts)
+
+    def test_download(self):
+        self.count(title="Title", message="Message")
+        self.git("push", "-q", "origin", "feature:refs/pull/1/head")
+        self.git("checkout", "-q", "master")
+        counts = self.count(download=[1])
+        self.assertEqual("Add feature", self.log_title("pull/1-jd-jd/feature"))
+        self.assertRoundtrips(5, 1, counts)
+
+    def test_setup_only(self):
+        counts = self.count(setup_only=True)
+        self.assertRoundtrips(3, 0, counts)
@@ -0,0 +1,35 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import stat
+
+from git_pull_request import tokens
+
+
+def test_store(tmp_path):
+    git_dir = str(tmp_path)
+    store = tokens.Store(git_dir, "pagure.io", "jd")
+    assert store.get("fork/jd/foo") is None
+    store.save("fork/jd/foo", "token")
+    assert "token" == store.get("fork/jd/foo")
+    assert store.get("fork/jd/bar") is None
+    assert tokens.Store(git_dir, "pagure.io", "other").get("fork/jd/foo") is None
+    assert 0o600 == stat.S_IMODE(os.stat(tokens.get_path(git_dir)).st_mode)
+
+    # A token replaced meanwhile is kept
+    store.reject("fork/jd/foo", "old")
+    assert "token" == store.get("fork/jd/foo")
+    store.reject("fork/jd/foo", "token")
+    assert store.get("fork/jd/foo") is None
@@ -0,0 +1,50 @@
+# -*- encoding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+
+import fixtures
+
+from git_pull_request import watch
+
+
+class TestChanges(fixtures.TestWithFixtures):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path, "ref")
+        self.ticks = 0
+        self.useFixture(fixtures.MonkeyPatch("time.sleep", self._sleep))
+
+    def _sleep(self, interval):
+        self.ticks += 1
+        # The ref is written twice in a row, then left alone
+        if self.ticks in (2, 3):
+            with open(self.path, "w") as f:
+                f.write("x" * self.ticks)
+
+    def test_debounce(self):
+        changes = watch.changes([self.path], debounce=2, clock=lambda: self.ticks)
+        next(changes)
+        # Reported once the ref has been stable for two ticks
+        self.assertEqual(5, self.ticks)
+
+    def test_ref_paths(self):
+        self.assertEqual(
+            [
+                "/repo/.git/refs/heads/main",
+                "/repo/.git/packed-refs",
+                "/repo/.git/logs/refs/heads/main",
+            ],
+            watch.get_ref_paths("/repo/.git", "refs/heads/main"),
+        )
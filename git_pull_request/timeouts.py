@@ -0,0 +1,65 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+connect_timeout = CONNECT_TIMEOUT
+read_timeout = READ_TIMEOUT
+_budget = None
+_deadline = None
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, phase):
+        super().__init__("Deadline of %gs exceeded while %s" % (_budget, phase))
+        self.phase = phase
+
+
+def configure(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, deadline=None):
+    """Set the network timeouts and the deadline of the run, in seconds."""
+    global connect_timeout, read_timeout, _budget, _deadline
+    connect_timeout = connect
+    read_timeout = read
+    _budget = deadline
+    _deadline = None if deadline is None else time.monotonic() + deadline
+
+
+def remaining():
+    """Return the time left before the deadline, or None without deadline."""
+    if _deadline is None:
+        return None
+    return max(0, _deadline - time.monotonic())
+
+
+def expired():
+    return remaining() == 0
+
+
+def check(phase):
+    if expired():
+        raise DeadlineExceeded(phase)
+
+
+def get(phase):
+    """Return the (connect, read) timeouts of a request, within the deadline.
+
+    :param phase: What the request is for, to report an exceeded deadline
+    """
+    check(phase)
+    left = remaining()
+    if left is None:
+        return connect_timeout, read_timeout
+    return min(connect_timeout, left), min(read_timeout, left)
@@ -0,0 +1,68 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Keep the API tokens created by git-pull-request in the git directory.
+
+They are kept apart from the git credentials, which hold the login of the
+user on the same hosts, in a file only readable by its owner.
+"""
+
+import json
+import os
+
+import attr
+
+from git_pull_request import lock
+
+
+def get_path(git_dir):
+    return os.path.join(git_dir, "git-pull-request", "tokens.json")
+
+
+def _load(git_dir):
+    try:
+        with open(get_path(git_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _update(git_dir, key, token):
+    with lock.locked(git_dir, "tokens"):
+        tokens = _load(git_dir)
+        if token is None:
+            tokens.pop(key, None)
+        else:
+            tokens[key] = token
+        lock.write_atomically(get_path(git_dir), json.dumps(tokens), mode=0o600)
+
+
+@attr.s
+class Store:
+    """The tokens of `user` on `host`, keyed by path."""
+
+    git_dir = attr.ib(type=str)
+    host = attr.ib(type=str)
+    user = attr.ib(type=str)
+
+    def _key(self, path):
+        return "%s@%s/%s" % (self.user, self.host, path)
+
+    def get(self, path):
+        return _load(self.git_dir).get(self._key(path))
+
+    def save(self, path, token):
+        _update(self.git_dir, self._key(path), token)
+
+    def reject(self, path, token):
+        if self.get(path) == token:
+            _update(self.git_dir, self._key(path), None)
@@ -0,0 +1,55 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import time
+
+
+def get_ref_paths(common_dir, ref):
+    """Return the files git modifies when `ref` is updated."""
+    return [
+        os.path.join(common_dir, ref),
+        os.path.join(common_dir, "packed-refs"),
+        os.path.join(common_dir, "logs", ref),
+    ]
+
+
+def _snapshot(paths):
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            result.append(None)
+        else:
+            result.append((st.st_ino, st.st_size, st.st_mtime_ns))
+    return result
+
+
+def changes(paths, interval=0.5, debounce=1.0, clock=time.monotonic):
+    """Yield each time `paths` change.
+
+    The files are polled every `interval` seconds and a change is only
+    reported once they have not changed for `debounce` seconds, so a commit
+    or a rebase updating the files several times is reported once.
+    """
+    last = _snapshot(paths)
+    changed_at = None
+    while True:
+        time.sleep(interval)
+        current = _snapshot(paths)
+        if current != last:
+            last = current
+            changed_at = clock()
+        elif changed_at is not None and clock() - changed_at >= debounce:
+            changed_at = None
+            yield